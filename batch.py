@@ -0,0 +1,224 @@
+import argparse
+import multiprocessing
+import os
+import struct
+import tempfile
+import cv2
+import numpy as np
+import filters
+
+"""
+Headless batch processing of recorded footage. Unlike cameo.py, this needs neither a camera nor a window, and never prompts:
+
+    python batch.py footage1.avi footage2.mp4 --filters strokeEdges,exoFilter --output-dir ./res/filterRes --workers 4
+
+A single Python loop can only use one core, so each input file is split into frame ranges ("segments") that a pool of processes filters in parallel.
+Each worker seeks to the first frame of its segment, runs the filter chain on every frame and writes the result to a temporary segment file. The parent
+collects the segments in order as they complete and stitches them into the output file, so stitching the first segments overlaps with filtering the
+later ones, and throughput scales with the number of cores. The last segment reads to the end of the file, in case the container under-reports its
+frame count.
+
+Every output frame is JPEG-compressed exactly once. When OpenCV's FFmpeg backend can write encoded frames as they are (VIDEOWRITER_PROP_RAW_VIDEO), the
+workers JPEG-encode their frames in parallel and the parent only copies the JPEG data into the MJPG output, without decoding anything. Otherwise the
+segment files hold the raw filtered frames, which takes much more temporary disk space, and the parent encodes them.
+
+The filter chain is a comma-separated list of filter names, with optional arguments (see filters.createFilter): strokeEdges, or the name of any
+VConvolutionFilter subclass in filters.py, e.g. strokeEdges:blurKsize=5,exoFilter. It runs through a FilterPipeline, like in Cameo.
+"""
+
+DEFAULT_FILTERS = 'strokeEdges,exoFilter'
+MJPG = cv2.VideoWriter_fourcc('M', 'J', 'P', 'G')
+JPEG_QUALITY = 90
+UNBOUNDED = 2 ** 31 - 1
+
+
+def buildFilterChain(filterNames):
+    """Return a FilterPipeline for a comma-separated list of filter names."""
+    return filters.createFilterPipeline(filterNames)
+
+
+def frameRanges(frameCount, segmentCount):
+    """Split frameCount frames into at most segmentCount contiguous (start, stop) ranges of nearly equal length."""
+    segmentCount = max(1, min(segmentCount, frameCount))
+    bounds = np.linspace(0, frameCount, segmentCount + 1).astype(int)
+    return [(int(start), int(stop)) for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+
+
+def _initWorker():
+    # The pool already uses every core, so keep OpenCV from starting its own threads in each worker.
+    cv2.setNumThreads(1)
+
+
+def canMuxJpeg(directory):
+    """Return True if OpenCV can write JPEG data into an MJPG file without decoding it."""
+    if not hasattr(cv2, 'VIDEOWRITER_PROP_RAW_VIDEO'):
+        return False
+    probeFilename = os.path.join(directory, 'probe.avi')
+    try:
+        writer = openJpegWriter(probeFilename, 30.0, (16, 16))
+        isOpened = writer.isOpened()
+        writer.release()
+    except cv2.error:
+        isOpened = False
+    if os.path.exists(probeFilename):
+        os.remove(probeFilename)
+    return isOpened
+
+
+def openJpegWriter(filename, fps, size):
+    """Return a VideoWriter whose write method takes JPEG data, as a 1-row uint8 array, and stores it as an MJPG frame."""
+    return cv2.VideoWriter(filename, cv2.CAP_FFMPEG, MJPG, fps, size, [cv2.VIDEOWRITER_PROP_RAW_VIDEO, 1])
+
+
+def _writeRecord(segmentFile, data):
+    data = memoryview(data)
+    segmentFile.write(struct.pack('<I', data.nbytes))
+    segmentFile.write(data)
+
+
+def _readRecords(segmentFilename):
+    with open(segmentFilename, 'rb') as segmentFile:
+        while True:
+            header = segmentFile.read(4)
+            if len(header) < 4:
+                return
+            yield segmentFile.read(struct.unpack('<I', header)[0])
+
+
+def processSegment(task):
+    """Filter frames [start, stop) of inputFilename into segmentFilename, as JPEG data if encodeJpeg is true, raw frames otherwise.
+
+    Return the number of frames written and the frame shape (None if no frame was written).
+    """
+    inputFilename, start, stop, segmentFilename, filterNames, encodeJpeg = task
+    pipeline = buildFilterChain(filterNames)
+    capture = cv2.VideoCapture(inputFilename)
+    if start > 0:
+        capture.set(cv2.CAP_PROP_POS_FRAMES, start)
+        if int(capture.get(cv2.CAP_PROP_POS_FRAMES)) != start:
+            # The backend cannot seek precisely, so decode our way there.
+            capture.release()
+            capture = cv2.VideoCapture(inputFilename)
+            for _ in range(start):
+                capture.grab()
+
+    framesWritten = 0
+    shape = None
+    with open(segmentFilename, 'wb') as segmentFile:
+        for _ in range(start, stop):
+            success, frame = capture.read()
+            if not success:
+                break
+            pipeline.apply(frame, frame)
+            if encodeJpeg:
+                _, jpeg = cv2.imencode('.jpg', frame, (cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY))
+                _writeRecord(segmentFile, jpeg.data)
+            else:
+                _writeRecord(segmentFile, np.ascontiguousarray(frame).data)
+            shape = frame.shape
+            framesWritten += 1
+
+    capture.release()
+    return framesWritten, shape
+
+
+def outputFilename(inputFilename, outputDirectory):
+    stem = os.path.splitext(os.path.basename(inputFilename))[0]
+    return os.path.join(outputDirectory, stem + '_filtered.avi')
+
+
+def processFiles(inputFilenames, outputDirectory, filterNames=DEFAULT_FILTERS, workers=None, segmentsPerWorker=2):
+    """Filter every input file into outputDirectory, splitting each one across a pool of worker processes.
+
+    Return a list of (outputFilename, framesWritten) in input order.
+    """
+    buildFilterChain(filterNames)  # Fail early on unknown filter names.
+    workers = workers or os.cpu_count() or 1
+    segmentDirectory = tempfile.mkdtemp(prefix='cameo-batch-', dir=outputDirectory)
+    encodeJpeg = canMuxJpeg(segmentDirectory)
+
+    tasks = []
+    files = []
+    for fileIndex, inputFilename in enumerate(inputFilenames):
+        capture = cv2.VideoCapture(inputFilename)
+        if not capture.isOpened():
+            raise IOError('cannot open %s' % inputFilename)
+        frameCount = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        fps = capture.get(cv2.CAP_PROP_FPS)
+        capture.release()
+        if fps <= 0.0:
+            fps = 30.0
+        if frameCount > 0:
+            ranges = frameRanges(frameCount, workers * segmentsPerWorker)
+            # The frame count may be an estimate, so let the last segment read to the end.
+            ranges[-1] = (ranges[-1][0], UNBOUNDED)
+        else:
+            # Unknown length: process the whole file as one segment.
+            ranges = [(0, UNBOUNDED)]
+        for segmentIndex, (start, stop) in enumerate(ranges):
+            segmentFilename = os.path.join(segmentDirectory, '%d_%d.seg' % (fileIndex, segmentIndex))
+            tasks.append((inputFilename, start, stop, segmentFilename, filterNames, encodeJpeg))
+        filename = outputFilename(inputFilename, outputDirectory)
+        if any(filename == other for other, _, _ in files):
+            # Two inputs with the same name from different directories.
+            filename = '%s_%d.avi' % (os.path.splitext(filename)[0], fileIndex)
+        files.append((filename, fps, len(ranges)))
+
+    results = []
+    pool = multiprocessing.Pool(workers, initializer=_initWorker)
+    try:
+        # imap returns the segments in order while later ones are still being filtered.
+        segments = zip(tasks, pool.imap(processSegment, tasks))
+        for filename, fps, segmentCount in files:
+            writer = None
+            framesWritten = 0
+            for _ in range(segmentCount):
+                task, (segmentFrames, shape) = next(segments)
+                segmentFilename = task[3]
+                if segmentFrames > 0:
+                    if writer is None:
+                        size = (shape[1], shape[0])
+                        writer = openJpegWriter(filename, fps, size) if encodeJpeg else cv2.VideoWriter(filename, MJPG, fps, size)
+                    for record in _readRecords(segmentFilename):
+                        data = np.frombuffer(record, np.uint8)
+                        # JPEG data goes into the file as is, raw frames are encoded here.
+                        writer.write(data.reshape(1, -1) if encodeJpeg else data.reshape(shape))
+                        framesWritten += 1
+                os.remove(segmentFilename)
+            if writer is not None:
+                writer.release()
+            results.append((filename, framesWritten))
+    finally:
+        pool.close()
+        pool.join()
+        for leftover in os.listdir(segmentDirectory):
+            os.remove(os.path.join(segmentDirectory, leftover))
+        os.rmdir(segmentDirectory)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Apply a filter chain to video files, in parallel across cores.')
+    parser.add_argument('inputs', nargs='+', help='video files to process')
+    parser.add_argument('--filters', default=DEFAULT_FILTERS,
+                        help='comma-separated filter chain, e.g. %s (default), from %s' % (DEFAULT_FILTERS, ', '.join(filters.filterNames())))
+    parser.add_argument('--output-dir', default='./res/filterRes', help='directory for the processed files')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: one per core)')
+    parser.add_argument('--segments-per-worker', type=int, default=2,
+                        help='frame ranges per worker and file, more balances the load better')
+    args = parser.parse_args()
+
+    try:
+        buildFilterChain(args.filters)
+    except ValueError as error:
+        parser.error(str(error))
+    if not os.path.isdir(args.output_dir):
+        os.makedirs(args.output_dir)
+
+    for filename, framesWritten in processFiles(args.inputs, args.output_dir, args.filters, args.workers,
+                                                args.segments_per_worker):
+        print('%s: %d frames' % (filename, framesWritten))
+
+
+if __name__ == '__main__':
+    main()
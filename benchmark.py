@@ -0,0 +1,650 @@
+import argparse
+import http.client
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.request
+import cv2
+import numpy as np
+import depth
+import filters
+from framepool import FramePool
+from managers import CaptureManager, MultiCaptureManager, PREFETCH_BLOCK
+from streaming import BOUNDARY, MJPEGStreamer
+
+"""
+Offline benchmark suite. It runs on synthetic frames and on video files that it generates itself, so it needs neither a camera nor a display, and the
+same command gives comparable numbers on any machine:
+
+    python benchmark.py --output before.json
+    python benchmark.py --output after.json --compare before.json
+
+Every measurement reports the throughput in calls (frames) per second, the per-call latency percentiles and the peak memory allocated through Python
+and numpy while it ran (OpenCV returns numpy arrays, so its output buffers are included). The suites are:
+    - strokeEdges: strokeEdges against StrokeEdgesFilter, after checking that the fast blend is within its documented tolerance, and
+      StrokeEdgesFilter at every QualityGovernor level.
+    - filters: every VConvolutionFilter subclass in filters.py.
+    - pipeline: FilterPipeline against sequential application, after checking that both give the same output.
+    - tiled: TiledFilter against the untiled filters, with and without pyramid levels, after checking that the output is bit-exact.
+    - incremental: IncrementalFilter against the plain filters on a static scene with a moving square, with and without pyramid levels, after checking
+      that the output is bit-exact.
+    - depth: depth.createMedianMask against MedianMask on a synthetic 8-bit disparity map, after checking that both give the same mask, alone and
+      as part of a CameoDepth frame, and createMedianMasks against a loop of createMedianMask calls over 4 frames and 4 rects.
+    - capture: the CaptureManager enterFrame/exitFrame cycle with a dummy window manager, reading from memory and from a generated MJPG file, with
+      and without the prefetching capture thread and a FramePool, and three MJPG files read in turn against MultiCaptureManager.
+    - streaming: MJPEGStreamer over localhost, after checking that publish ignores frames nobody asked for, that /snapshot returns a frame published
+      after the request and that /stream delivers decodable parts: publish without a client, a /snapshot round trip and one /stream part.
+With --output, the results are written as JSON together with the commit, library versions and machine they were measured on. With --compare, each
+result is printed next to the matching result of an earlier run.
+"""
+
+RESOLUTIONS = {
+    '360p': (360, 640),
+    '720p': (720, 1280),
+    '1080p': (1080, 1920),
+}
+
+SUITES = ('strokeEdges', 'filters', 'pipeline', 'tiled', 'incremental', 'depth', 'capture', 'streaming')
+
+
+def syntheticFrame(height, width, seed=0):
+    """Return a BGR frame with smooth regions and edges, closer to camera footage than pure noise."""
+    rng = np.random.default_rng(seed)
+    noise = rng.integers(0, 256, (height // 8, width // 8, 3), dtype=np.uint8)
+    frame = cv2.resize(noise, (width, height), interpolation=cv2.INTER_NEAREST)
+    return cv2.GaussianBlur(frame, (0, 0), 2)
+
+
+def syntheticDisparity(height, width, seed=0):
+    """Return an 8-bit disparity map with a few layers at different depths, and its valid depth mask."""
+    rng = np.random.default_rng(seed)
+    disparityMap = np.full((height, width), 40, np.uint8)
+    for _ in range(6):
+        x, y = rng.integers(0, width // 2), rng.integers(0, height // 2)
+        disparityMap[y:y + height // 3, x:x + width // 3] = rng.integers(60, 200)
+    disparityMap += rng.integers(0, 6, (height, width), dtype=np.uint8)
+    validDepthMask = (rng.random((height, width)) > 0.05).astype(np.uint8)
+    return disparityMap, validDepthMask
+
+
+def timeCalls(function, repeat):
+    """Return the mean wall time of function() in milliseconds, after one warm-up call."""
+    function()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - start) * 1000.0 / repeat
+
+
+def measure(function, repeat):
+    """Call function() repeat times after one warm-up call. Return its throughput, latency percentiles and peak traced memory.
+
+    function may return False to signal that it ran out of input, in which case the measurement stops early.
+    """
+    function()
+    latencies = []
+    tracemalloc.start()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        callStart = time.perf_counter()
+        if function() is False:
+            break
+        latencies.append(time.perf_counter() - callStart)
+    elapsed = time.perf_counter() - start
+    _, peakMemory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies = np.array(latencies) * 1000.0
+    return {
+        'calls': len(latencies),
+        'fps': len(latencies) / elapsed if elapsed > 0 else 0.0,
+        'latencyMs': {
+            'mean': float(latencies.mean()),
+            'p50': float(np.percentile(latencies, 50)),
+            'p95': float(np.percentile(latencies, 95)),
+            'p99': float(np.percentile(latencies, 99)),
+            'max': float(latencies.max()),
+        },
+        'peakMemoryBytes': peakMemory,
+    }
+
+
+def convolutionFilterClasses():
+    """Return every VConvolutionFilter subclass defined in filters.py that takes no constructor arguments."""
+    classes = []
+    pending = [filters.VConvolutionFilter]
+    while pending:
+        for subclass in pending.pop().__subclasses__():
+            pending.append(subclass)
+            if subclass.__module__ == filters.__name__:
+                classes.append(subclass)
+    return sorted(classes, key=lambda cls: cls.__name__)
+
+
+def benchmarkStrokeEdges(height, width, repeat, blurKsize=7):
+    src = syntheticFrame(height, width)
+    reference = np.empty_like(src)
+    filters.strokeEdges(src, reference, blurKsize)
+
+    fastFilter = filters.StrokeEdgesFilter(blurKsize)
+    exactFilter = filters.StrokeEdgesFilter(blurKsize, exact=True)
+    fast = np.empty_like(src)
+    exact = np.empty_like(src)
+    fastFilter.apply(src, fast)
+    exactFilter.apply(src, exact)
+
+    difference = fast.astype(np.int16) - reference
+    assert np.array_equal(exact, reference), 'exact StrokeEdgesFilter differs from strokeEdges'
+    assert difference.min() >= 0 and difference.max() <= 1, 'StrokeEdgesFilter is outside its documented tolerance'
+
+    dst = np.empty_like(src)
+    details = {'blurKsize': blurKsize, 'fractionAboveReference': np.count_nonzero(difference) / difference.size}
+    return [
+        ('strokeEdges', measure(lambda: filters.strokeEdges(src, dst, blurKsize), repeat), details),
+        ('StrokeEdgesFilter', measure(lambda: fastFilter.apply(src, dst), repeat), details),
+        ('StrokeEdgesFilter(exact=True)', measure(lambda: exactFilter.apply(src, dst), repeat), details),
+    ]
+
+
+def benchmarkQualityLevels(height, width, repeat):
+    """Time StrokeEdgesFilter at every QualityGovernor level, with the mean difference from the full-quality output."""
+    src = syntheticFrame(height, width)
+    dst = np.empty_like(src)
+    best = None
+    results = []
+    for level, (pyramidLevel, blurKsize, edgeKsize) in enumerate(filters.QUALITY_LEVELS):
+        aFilter = filters.StrokeEdgesFilter(blurKsize, edgeKsize, pyramidLevel=pyramidLevel)
+        aFilter.apply(src, dst)
+        if best is None:
+            best = dst.copy()
+        details = {'pyramidLevel': pyramidLevel, 'edgeKsize': edgeKsize,
+                   'meanAbsDifference': float(np.mean(cv2.absdiff(dst, best)))}
+        results.append(('StrokeEdgesFilter quality level %d' % level, measure(lambda: aFilter.apply(src, dst), repeat), details))
+    return results
+
+
+def benchmarkConvolutionFilters(height, width, repeat):
+    src = syntheticFrame(height, width)
+    dst = np.empty_like(src)
+    results = []
+    for cls in convolutionFilterClasses():
+        aFilter = cls()
+        results.append((cls.__name__, measure(lambda: aFilter.apply(src, dst), repeat), {}))
+    return results
+
+
+class _LargeKernelFilter(filters.VConvolutionFilter):  # A 15x15 kernel that is not separable, which filter2D runs through the DFT
+    def __init__(self):
+        kernel = np.random.default_rng(1).normal(size=(15, 15))
+        filters.VConvolutionFilter.__init__(self, kernel / kernel.sum())
+
+
+def pipelineCases():
+    """Return (label, filters, frame dtype, tolerance) for the pipelines checked by benchmarkPipelines."""
+    return [
+        ('Cameo', [filters.StrokeEdgesFilter(), filters.exoFilter()], np.uint8, 0),
+        ('CameoDepth', [filters.StrokeEdgesFilter(), filters.FindEdgesFilter()], np.uint8, 0),
+        ('blur, emboss', [filters.BlurFilter(), filters.EmbossFilter()], np.uint8, 0),
+        ('blur x2, sharpen', [filters.BlurFilter(), filters.BlurFilter(), filters.SharpenFilter()], np.float32, 1e-4),
+        ('sharpen, 15x15', [filters.SharpenFilter(), _LargeKernelFilter()], np.float32, 1e-4),
+    ]
+
+
+def benchmarkPipelines(height, width, repeat):
+    frame = syntheticFrame(height, width)
+    results = []
+    for label, pipelineFilters, dtype, tolerance in pipelineCases():
+        src = frame if dtype == np.uint8 else frame.astype(dtype) / 255
+        pipeline = filters.FilterPipeline(pipelineFilters)
+        expected = np.empty_like(src)
+        actual = np.empty_like(src)
+        pipeline.applySequential(src, expected)
+        pipeline.apply(src, actual)
+        difference = np.abs(actual.astype(np.float64) - expected).max()
+        assert difference <= tolerance, '%s pipeline differs from sequential application by %g' % (label, difference)
+
+        dst = np.empty_like(src)
+        details = {'plan': pipeline.describe(src.shape, src.dtype), 'maxDifference': float(difference)}
+        results.append((label + ' (sequential)', measure(lambda: pipeline.applySequential(src, dst), repeat), details))
+        results.append((label + ' (pipeline)', measure(lambda: pipeline.apply(src, dst), repeat), details))
+    return results
+
+
+def benchmarkTiled(height, width, repeat):
+    src = syntheticFrame(height, width)
+    threadCount = os.cpu_count() or 1
+    cases = [
+        ('StrokeEdgesFilter', filters.StrokeEdgesFilter()),
+        ('StrokeEdgesFilter(pyramidLevel=1)', filters.StrokeEdgesFilter(pyramidLevel=1)),
+        ('Cameo pipeline', filters.FilterPipeline([filters.StrokeEdgesFilter(), filters.exoFilter()])),
+        ('Cameo pipeline, pyramid level 2', filters.FilterPipeline([filters.StrokeEdgesFilter(pyramidLevel=2), filters.exoFilter()])),
+        ('BlurFilter', filters.BlurFilter()),
+    ]
+    results = []
+    for label, aFilter in cases:
+        tiledFilter = filters.TiledFilter(aFilter, tileCount=2 * threadCount + 1, threadCount=threadCount)
+        # Also check a frame one row short, whose height is not a multiple of the pyramid's alignment.
+        for frame in (src, src[:-1]):
+            expected = frame.copy()
+            actual = frame.copy()
+            aFilter.apply(expected, expected)
+            tiledFilter.apply(actual, actual)
+            assert np.array_equal(actual, expected), 'tiled %s differs from the untiled filter' % label
+
+        dst = np.empty_like(src)
+        details = {'tileCount': tiledFilter.tileCount, 'threadCount': tiledFilter.threadCount, 'radius': tiledFilter.radius}
+        results.append((label + ' (untiled)', measure(lambda: aFilter.apply(src, dst), repeat), details))
+        results.append((label + ' (tiled)', measure(lambda: tiledFilter.apply(src, dst), repeat), details))
+        tiledFilter.close()
+    return results
+
+
+def movingSquareFrames(height, width, count):
+    """Return count frames of a static synthetic scene in which an inverted square moves diagonally."""
+    background = syntheticFrame(height, width)
+    size = min(height, width) // 8
+    frames = []
+    for index in range(count):
+        frame = background.copy()
+        y = (index * 13) % (height - size)
+        x = (index * 29) % (width - size)
+        frame[y:y + size, x:x + size] = 255 - frame[y:y + size, x:x + size]
+        frames.append(frame)
+    return frames
+
+
+def benchmarkIncremental(height, width, repeat):
+    frames = movingSquareFrames(height, width, 16)
+    cases = [
+        ('StrokeEdgesFilter', filters.StrokeEdgesFilter),
+        ('Cameo pipeline', lambda: filters.FilterPipeline([filters.StrokeEdgesFilter(), filters.exoFilter()])),
+        ('Cameo pipeline, pyramid level 1', lambda: filters.FilterPipeline([filters.StrokeEdgesFilter(pyramidLevel=1), filters.exoFilter()])),
+    ]
+    results = []
+    for label, createFilter in cases:
+        aFilter = createFilter()
+        incrementalFilter = filters.IncrementalFilter(createFilter())
+        expected = np.empty_like(frames[0])
+        actual = np.empty_like(frames[0])
+        for frame in frames:
+            aFilter.apply(frame, expected)
+            incrementalFilter.apply(frame, actual)
+            assert np.array_equal(actual, expected), 'incremental %s differs from the plain filter' % label
+
+        dst = np.empty_like(frames[0])
+        counter = [0]
+
+        def nextFrame():
+            counter[0] += 1
+            return frames[counter[0] % len(frames)]
+
+        results.append((label + ' (every pixel)', measure(lambda: aFilter.apply(nextFrame(), dst), repeat), {}))
+        results.append((label + ' (incremental)', measure(lambda: incrementalFilter.apply(nextFrame(), dst), repeat),
+                        {'meanChangedTileRatio': incrementalFilter.stats()['meanChangedTileRatio']}))
+    return results
+
+
+def benchmarkDepth(height, width, repeat):
+    disparityMap, validDepthMask = syntheticDisparity(height, width)
+    rect = (width // 4, height // 4, width // 2, height // 2)
+    medianMask = depth.MedianMask()
+    smoothedMedianMask = depth.MedianMask(temporalSmoothing=0.8)
+    assert np.array_equal(medianMask.apply(disparityMap, validDepthMask),
+                          depth.createMedianMask(disparityMap, validDepthMask)), 'MedianMask differs from createMedianMask'
+    assert np.array_equal(medianMask.apply(disparityMap, validDepthMask, rect),
+                          depth.createMedianMask(disparityMap, validDepthMask, rect)), 'MedianMask differs from createMedianMask'
+
+    # The depth-specific part of CameoDepth.run(): mask everything but the median layer, then filter the frame.
+    frame = syntheticFrame(height, width)
+    scratch = np.empty_like(frame)
+    pipeline = filters.FilterPipeline([filters.StrokeEdgesFilter(), filters.FindEdgesFilter()])
+
+    def cameoDepthFrame(createMask):
+        scratch[...] = frame
+        mask = createMask(disparityMap, validDepthMask)
+        scratch[mask == 0] = 0
+        pipeline.apply(scratch, scratch)
+
+    return [
+        ('createMedianMask', measure(lambda: depth.createMedianMask(disparityMap, validDepthMask), repeat), {}),
+        ('MedianMask', measure(lambda: medianMask.apply(disparityMap, validDepthMask), repeat), {}),
+        ('MedianMask(temporalSmoothing=0.8)',
+         measure(lambda: smoothedMedianMask.apply(disparityMap, validDepthMask), repeat), {}),
+        ('createMedianMask(rect)', measure(lambda: depth.createMedianMask(disparityMap, validDepthMask, rect), repeat), {}),
+        ('MedianMask(rect)', measure(lambda: medianMask.apply(disparityMap, validDepthMask, rect), repeat), {}),
+        ('CameoDepth frame, createMedianMask', measure(lambda: cameoDepthFrame(depth.createMedianMask), repeat), {}),
+        ('CameoDepth frame, MedianMask', measure(lambda: cameoDepthFrame(medianMask.apply), repeat), {}),
+    ] + benchmarkBatchedDepth(height, width, repeat)
+
+
+def benchmarkBatchedDepth(height, width, repeat, frameCount=4):
+    stack = [syntheticDisparity(height, width, seed) for seed in range(frameCount)]
+    disparityMaps = np.stack([disparityMap for disparityMap, _ in stack])
+    validDepthMasks = np.stack([validDepthMask for _, validDepthMask in stack])
+    rects = [(0, 0, width // 2, height // 2), (width // 2, 0, width // 2, height // 2),
+             (0, height // 2, width // 2, height // 2), (width // 4, height // 4, width // 2, height // 2)]
+    masks, _ = depth.createMedianMasks(disparityMaps, validDepthMasks, rects)
+    for index in range(frameCount):
+        for rectIndex, (x, y, w, h) in enumerate(rects):
+            expected = depth.createMedianMask(disparityMaps[index], validDepthMasks[index], rects[rectIndex])
+            assert np.array_equal(masks[index, rectIndex, y:y+h, x:x+w], expected), 'createMedianMasks differs from createMedianMask'
+
+    def loop():
+        for index in range(frameCount):
+            for rect in rects:
+                depth.createMedianMask(disparityMaps[index], validDepthMasks[index], rect)
+
+    details = {'frames': frameCount, 'rects': len(rects)}
+    return [
+        ('createMedianMask, frames x rects loop', measure(loop, repeat), details),
+        ('createMedianMasks', measure(lambda: depth.createMedianMasks(disparityMaps, validDepthMasks, rects, masks=masks),
+                                      repeat), details),
+    ]
+
+
+class _DummyWindowManager(object):  # Stands in for WindowManager without opening a window
+    def show(self, frame):
+        pass
+
+
+class _MemoryCapture(object):  # A VideoCapture look-alike that returns copies of a synthetic frame
+    def __init__(self, frame, frameCount):
+        self._frame = frame
+        self._framesLeft = frameCount
+
+    def grab(self):
+        self._framesLeft -= 1
+        return self._framesLeft >= 0
+
+    def retrieve(self, image=None, channel=0):
+        # Like VideoCapture, write into the given image when it matches.
+        if image is not None and image.shape == self._frame.shape and image.dtype == self._frame.dtype:
+            np.copyto(image, self._frame)
+            return True, image
+        return True, self._frame.copy()
+
+    def get(self, propId):
+        return 30.0 if propId == cv2.CAP_PROP_FPS else 0.0
+
+    def release(self):
+        pass
+
+
+def writeVideoFile(filename, height, width, frameCount):
+    """Write frameCount synthetic MJPG frames to filename."""
+    writer = cv2.VideoWriter(filename, cv2.VideoWriter_fourcc('M', 'J', 'P', 'G'), 30.0, (width, height))
+    for index in range(frameCount):
+        writer.write(syntheticFrame(height, width, seed=index % 8))
+    writer.release()
+
+
+def benchmarkCapture(height, width, repeat, videoDirectory):
+    videoFilename = os.path.join(videoDirectory, '%dx%d.avi' % (width, height))
+    if not os.path.exists(videoFilename):
+        writeVideoFile(videoFilename, height, width, repeat + 2)
+
+    sources = [
+        ('memory', lambda: _MemoryCapture(syntheticFrame(height, width), repeat + 2)),
+        ('MJPG file', lambda: cv2.VideoCapture(videoFilename)),
+    ]
+    results = []
+    for sourceLabel, openSource in sources:
+        for prefetchPolicy in (None, PREFETCH_BLOCK):
+            for framePool in (None, FramePool()):
+                captureManager = CaptureManager(openSource(), _DummyWindowManager(), True, prefetchPolicy=prefetchPolicy,
+                                                framePool=framePool)
+
+                def cycle():
+                    captureManager.enterFrame()
+                    frame = captureManager.frame
+                    captureManager.exitFrame()
+                    return frame is not None
+
+                label = 'enterFrame/exitFrame, %s%s%s' % (sourceLabel, ', prefetch' if prefetchPolicy else '',
+                                                          ', pool' if framePool is not None else '')
+                measurement = measure(cycle, repeat)
+                results.append((label, measurement, {'framePool': framePool.stats() if framePool is not None else None}))
+                captureManager.release()
+
+    # Several files at once: one grab loop versus one MultiCaptureManager frame that retrieves all of them in parallel.
+    sourceCount = 3
+    captures = [cv2.VideoCapture(videoFilename) for _ in range(sourceCount)]
+
+    def sequentialCycle():
+        frames = []
+        for capture in captures:
+            success, frame = capture.read()
+            if not success:
+                return False
+            frames.append(frame)
+        return True
+
+    results.append(('%d MJPG files, sequential read' % sourceCount, measure(sequentialCycle, repeat), {}))
+    for capture in captures:
+        capture.release()
+
+    multiCaptureManager = MultiCaptureManager([cv2.VideoCapture(videoFilename) for _ in range(sourceCount)], _DummyWindowManager())
+
+    def multiCycle():
+        if not multiCaptureManager.enterFrame():
+            return False
+        frames = multiCaptureManager.frames
+        multiCaptureManager.exitFrame()
+        return all(sourceFrame.image is not None for sourceFrame in frames)
+
+    results.append(('%d MJPG files, MultiCaptureManager' % sourceCount, measure(multiCycle, repeat),
+                    {'skewMs': multiCaptureManager.stats()['skew']}))
+    multiCaptureManager.release()
+    return results
+
+
+class _Publisher(object):  # Publishes a frame to a streamer every few milliseconds on a thread, like a capture loop
+    def __init__(self, streamer, frame, interval=0.005):
+        self.frame = frame
+        self._streamer = streamer
+        self._interval = interval
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self._interval):
+            self._streamer.publish(self.frame)
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+
+def fetchSnapshot(host, port):
+    """Return the decoded frame served by a streamer's /snapshot, or None on an error status."""
+    try:
+        with urllib.request.urlopen('http://%s:%d/snapshot' % (host, port), timeout=5.0) as response:
+            return cv2.imdecode(np.frombuffer(response.read(), np.uint8), cv2.IMREAD_COLOR)
+    except urllib.error.HTTPError:
+        return None
+
+
+def readStreamPart(response):
+    """Read the next part of a multipart MJPEG response and return it decoded."""
+    assert response.readline().strip() == b'--' + BOUNDARY, 'bad MJPEG part boundary'
+    length = None
+    while True:
+        line = response.readline().strip()
+        if not line:
+            break
+        name, _, value = line.partition(b':')
+        if name.lower() == b'content-length':
+            length = int(value)
+    jpeg = response.read(length)
+    response.readline()
+    return cv2.imdecode(np.frombuffer(jpeg, np.uint8), cv2.IMREAD_COLOR)
+
+
+def benchmarkStreaming(height, width, repeat):
+    frames = [syntheticFrame(height, width, seed) for seed in range(2)]
+    streamer = MJPEGStreamer(port=0, quality=90, timeout=2.0)
+    host, port = streamer.address
+    publisher = None
+    connection = None
+    try:
+        assert not streamer.publish(frames[0]), 'MJPEGStreamer copied a frame without any client'
+
+        def publishWithoutClient():
+            streamer.publish(frames[0])  # Returns False, which measure would take for the end of the input.
+
+        results = [('publish, no client', measure(publishWithoutClient, repeat), {})]
+
+        # Each snapshot must be a frame published after the request, not the last one encoded.
+        publisher = _Publisher(streamer, frames[0])
+        for frame in frames:
+            publisher.frame = frame
+            time.sleep(0.1)
+            snapshot = fetchSnapshot(host, port)
+            assert snapshot is not None and snapshot.shape == frame.shape, '/snapshot returned no frame'
+            others = [other for other in frames if other is not frame]
+            assert all(np.mean(cv2.absdiff(snapshot, frame)) < np.mean(cv2.absdiff(snapshot, other)) for other in others), \
+                '/snapshot returned a stale frame'
+
+        connection = http.client.HTTPConnection(host, port, timeout=5.0)
+        connection.request('GET', '/stream')
+        response = connection.getresponse()
+        assert response.getheader('Content-Type').startswith('multipart/x-mixed-replace'), '/stream is not a multipart response'
+        for _ in range(3):
+            part = readStreamPart(response)
+            assert part is not None and part.shape == frames[0].shape, '/stream sent an undecodable part'
+        connection.close()
+        connection = None
+
+        publisher.frame = frames[0]
+        results.append(('/snapshot round trip', measure(lambda: fetchSnapshot(host, port) is not None, repeat), {}))
+        connection = http.client.HTTPConnection(host, port, timeout=5.0)
+        connection.request('GET', '/stream')
+        response = connection.getresponse()
+        results.append(('/stream part', measure(lambda: readStreamPart(response) is not None, repeat), {}))
+        return results
+    finally:
+        if connection is not None:
+            connection.close()
+        if publisher is not None:
+            publisher.stop()
+        streamer.close()
+
+
+def runSuites(suites, resolutions, repeat):
+    results = []
+    videoDirectory = tempfile.mkdtemp(prefix='cameo-benchmark-')
+    try:
+        for resolution in resolutions:
+            height, width = RESOLUTIONS[resolution]
+            runs = []
+            if 'strokeEdges' in suites:
+                # medianBlur is shared by both implementations and dominates with the default ksize of 7, so also measure without it.
+                runs.append(('strokeEdges', benchmarkStrokeEdges(height, width, repeat, 7)))
+                runs.append(('strokeEdges', benchmarkStrokeEdges(height, width, repeat, 0)))
+                runs.append(('strokeEdges', benchmarkQualityLevels(height, width, repeat)))
+            if 'filters' in suites:
+                runs.append(('filters', benchmarkConvolutionFilters(height, width, repeat)))
+            if 'pipeline' in suites:
+                runs.append(('pipeline', benchmarkPipelines(height, width, repeat)))
+            if 'tiled' in suites:
+                runs.append(('tiled', benchmarkTiled(height, width, repeat)))
+            if 'incremental' in suites:
+                runs.append(('incremental', benchmarkIncremental(height, width, repeat)))
+            if 'depth' in suites:
+                runs.append(('depth', benchmarkDepth(height, width, repeat)))
+            if 'capture' in suites:
+                runs.append(('capture', benchmarkCapture(height, width, repeat, videoDirectory)))
+            if 'streaming' in suites:
+                runs.append(('streaming', benchmarkStreaming(height, width, repeat)))
+
+            for suite, measurements in runs:
+                for name, measurement, details in measurements:
+                    result = {'suite': suite, 'name': name, 'resolution': resolution}
+                    result.update(measurement)
+                    result.update(details)
+                    results.append(result)
+                    printResult(result)
+    finally:
+        shutil.rmtree(videoDirectory, ignore_errors=True)
+    return results
+
+
+def resultKey(result):
+    return result['suite'], result['name'], result['resolution'], result.get('blurKsize')
+
+
+def printResult(result, baseline=None):
+    name = result['name']
+    if 'blurKsize' in result:
+        name += ' blurKsize=%d' % result['blurKsize']
+    line = '%-11s %-6s %-48s %8.1f fps  p50 %8.2f ms  p95 %8.2f ms  p99 %8.2f ms  peak %7.1f MiB' % (
+        result['suite'], result['resolution'], name, result['fps'], result['latencyMs']['p50'],
+        result['latencyMs']['p95'], result['latencyMs']['p99'], result['peakMemoryBytes'] / 2.0 ** 20)
+    if baseline is not None:
+        line += '  x%.2f fps vs baseline' % (result['fps'] / baseline['fps'])
+    print(line)
+
+
+def metadata():
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                         stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'commit': commit,
+        'python': sys.version.split()[0],
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpuCount': os.cpu_count(),
+        'openCVThreads': cv2.getNumThreads(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark filters, depth masking and capture on synthetic input.')
+    parser.add_argument('--suites', default=','.join(SUITES), help='comma-separated subset of %s' % ', '.join(SUITES))
+    parser.add_argument('--resolutions', default='360p,720p,1080p',
+                        help='comma-separated subset of %s' % ', '.join(RESOLUTIONS))
+    parser.add_argument('--repeat', type=int, default=30, help='timed calls (frames) per measurement')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='JSON file of an earlier run to compare the results with')
+    args = parser.parse_args()
+
+    suites = args.suites.split(',')
+    resolutions = args.resolutions.split(',')
+    for name in suites:
+        if name not in SUITES:
+            parser.error('unknown suite: %s' % name)
+    for name in resolutions:
+        if name not in RESOLUTIONS:
+            parser.error('unknown resolution: %s' % name)
+
+    report = {'metadata': metadata(), 'repeat': args.repeat, 'results': runSuites(suites, resolutions, args.repeat)}
+
+    if args.compare:
+        with open(args.compare) as baselineFile:
+            baseline = {resultKey(result): result for result in json.load(baselineFile)['results']}
+        print('\nCompared with %s:' % args.compare)
+        for result in report['results']:
+            if resultKey(result) in baseline:
+                printResult(result, baseline[resultKey(result)])
+
+    if args.output:
+        with open(args.output, 'w') as outputFile:
+            json.dump(report, outputFile, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,36 +1,197 @@
+import time
+_importStart = time.perf_counter()
+import argparse
+import datetime
+import os
 import cv2
-import filters
-from managers import WindowManager, CaptureManager
 import depth
+import filters
+from framepool import FramePool
+from managers import WindowManager, CaptureManager, LazyCapture, PREFETCH_BLOCK, PREFETCH_DROP_OLDEST
+from writers import MIN_SEGMENT_BYTES, PreRollBuffer
+_importSeconds = time.perf_counter() - _importStart
 
 """
 Our application is represented by the Cameo class with two methods :
     - run()
     - onKeypress()
-ON initializing, a Cameo object created a WindowManager object with onKeypress as a callback, as well as a CaptureManager object using a camera 
-(specifically, a cv2.VideoCapture object) and the same WindowManager object. When run is called the application execute a min loop in which frames 
+ON initializing, a Cameo object created a WindowManager object with onKeypress as a callback, as well as a CaptureManager object using a camera
+(specifically, a cv2.VideoCapture object) and the same WindowManager object. When run is called the application execute a min loop in which frames
  and events are processed.
+
+Cameo is started from the command line and never prompts, so it can be scripted and timed:
+
+    python cameo.py                                    # filter the camera 0 feed with strokeEdges,exoFilter
+    python cameo.py depth                              # the depth camera version
+    python cameo.py --source clip.avi --filters strokeEdges:blurKsize=5,SharpenFilter --headless --record out.avi
+    python cameo.py --list-filters
+    python cameo.py --warmup --frame-size 1280x720 --startup-profile
+
+The camera opens lazily (see LazyCapture), on the prefetching thread's first grab, so it opens in the background while the filters warm up. Screenshots
+(space) and recordings (tab) get timestamped names in the output directory. With --segment-seconds or --segment-mb, recordings are split into segment files
+with a JSON manifest (see SegmentedVideoWriter in writers.py).
 """
 
+DEFAULT_FILTERS = 'strokeEdges,exoFilter'
+DEPTH_FILTERS = 'strokeEdges,FindEdgesFilter'
+OUTPUT_DIRECTORY = './res/filterRes'
+DEFAULT_TARGET_FPS = 30.0
+DEFAULT_PRE_ROLL_MB = 256
+
+
 class Cameo(object):
-    def __init__(self):
-        self._windowManager = WindowManager('Cameo', self.onKeypress)
-        self._captureManager = CaptureManager(cv2.VideoCapture(0), self._windowManager, True)
-        self._curveFilter = filters.exoFilter()
+    def __init__(self, source=0, filterChain=DEFAULT_FILTERS, outputDirectory=OUTPUT_DIRECTORY, frameSize=None, headless=False,
+                 displayFps=None, streamPort=None, preRollSeconds=5.0,
+                 preRollMaxBytes=DEFAULT_PRE_ROLL_MB * 2 ** 20, preRollJpegQuality=None, targetFps=None, threadCount=1, incremental=False,
+                 warmup=False, maxFrames=None, recordFilename=None, startupProfile=False, startTime=None,
+                 segmentSeconds=None, segmentBytes=None):
+        self._startTime = time.perf_counter() if startTime is None else startTime
+        self._outputDirectory = outputDirectory
+        self._frameSize = frameSize
+        self._streamPort = streamPort
+        self._streamer = None
+        self._warmup = warmup
+        self._warmupSeconds = None
+        self._maxFrames = maxFrames
+        self._recordFilename = recordFilename
+        self._segmentSeconds = segmentSeconds
+        self._segmentBytes = segmentBytes
+        self._startupProfile = startupProfile
+
+        self._windowManager = None if headless else WindowManager('Cameo', self.onKeypress, displayFps)
+        properties = ()
+        if frameSize is not None:
+            properties = ((cv2.CAP_PROP_FRAME_WIDTH, frameSize[0]), (cv2.CAP_PROP_FRAME_HEIGHT, frameSize[1]))
+        self._capture = LazyCapture(source, properties)
+        preRollBuffer = None
+        if preRollSeconds > 0:
+            preRollBuffer = PreRollBuffer(seconds=preRollSeconds, maxBytes=preRollMaxBytes, jpegQuality=preRollJpegQuality)
+        self._captureManager = self._createCaptureManager(self._capture, isinstance(source, int), preRollBuffer)
+
+        self._filterPipeline = filters.createFilterPipeline(filterChain)
+        self._processingFilter = self._filterPipeline
+        if threadCount > 1:
+            self._processingFilter = filters.TiledFilter(self._processingFilter, threadCount=threadCount)
+        if incremental:
+            self._processingFilter = filters.IncrementalFilter(self._processingFilter)
+
+        # Lower the stroke quality when filtering cannot keep up, and raise it again when it can. By default only for a camera: a video file can be
+        # filtered at its own pace, and its output should not depend on the machine's load.
+        if targetFps is None:
+            targetFps = DEFAULT_TARGET_FPS if isinstance(source, int) else 0
+        self._qualityGovernor = None
+        strokeEdgesFilters = [aFilter for aFilter in self._filterPipeline.filters if isinstance(aFilter, filters.StrokeEdgesFilter)]
+        if targetFps and strokeEdgesFilters:
+            self._qualityGovernor = filters.QualityGovernor(strokeEdgesFilters[0], targetFps=targetFps)
+
+    def _createCaptureManager(self, capture, isCamera, preRollBuffer):
+        # Grab and decode the next frame on a background thread while the current one is being filtered. A camera drops stale frames, a file does not.
+        # Recycle the frame arrays instead of allocating new ones on every frame, and start recordings with the pre-roll.
+        return CaptureManager(capture, self._windowManager, True,
+                              prefetchPolicy=PREFETCH_DROP_OLDEST if isCamera else PREFETCH_BLOCK, framePool=FramePool(),
+                              preRollBuffer=preRollBuffer)
 
     def run(self):
         """Run the main loop."""
-        self._windowManager.createWindow()
-        while self._windowManager.isWindowCreated:
-            self._captureManager.enterFrame()
-            frame = self._captureManager.frame
+        if self._warmup:
+            self._warmUp()
+        if self._streamPort is not None:
+            # Imported here because http.server alone adds about 40 ms to every start.
+            from streaming import MJPEGStreamer
+            self._streamer = MJPEGStreamer(port=self._streamPort)
+            self._captureManager.streamer = self._streamer
+        if self._recordFilename is not None:
+            self._captureManager.startWritingVideo(self._recordFilename, segmentSeconds=self._segmentSeconds,
+                                                   segmentBytes=self._segmentBytes)
+        if self._windowManager is not None:
+            self._windowManager.createWindow()
+
+        framesProcessed = 0
+        try:
+            while self._isRunning(framesProcessed):
+                self._captureManager.enterFrame()
+                frame = self._processFrame()
+                self._captureManager.exitFrame()
+
+                if frame is not None:
+                    framesProcessed += 1
+                    if framesProcessed == 1 and self._startupProfile:
+                        self._printStartupProfile()
+                    self._updateQuality()
+                elif framesProcessed == 0 and not self._capture.isOpened():
+                    raise IOError('cannot open source %r' % (self._capture.source,))
+                elif self._windowManager is None:
+                    # Without a window, the end of the source ends the run.
+                    break
+                if self._windowManager is not None:
+                    self._windowManager.processEvents()
+        finally:
+            self._shutDown()
+
+    def _isRunning(self, framesProcessed):
+        if self._maxFrames is not None and framesProcessed >= self._maxFrames:
+            return False
+        return self._windowManager is None or self._windowManager.isWindowCreated
+
+    def _processFrame(self):
+        """Filter the current frame in place and return it, or None if there is no frame."""
+        frame = self._captureManager.frame
+        if frame is not None:
+            self._processingFilter.apply(frame, frame)
+        return frame
+
+    def _warmUp(self):
+        if self._frameSize is not None:
+            width, height = self._frameSize
+        else:
+            # This waits for the device to open.
+            width = int(self._captureManager.get(cv2.CAP_PROP_FRAME_WIDTH))
+            height = int(self._captureManager.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        if width > 0 and height > 0:
+            self._warmupSeconds = filters.warmUp(self._processingFilter, (height, width, 3))
 
-            if frame is not None:
-                filters.strokeEdges(frame, frame)
-                self._curveFilter.apply(frame, frame)
+    def _updateQuality(self):
+        if self._qualityGovernor is None:
+            return
+        if self._qualityGovernor.update(self._captureManager.telemetry.latest('process')):
+            print("Quality level : %(level)d (pyramid level %(pyramidLevel)d, blurKsize %(blurKsize)d, edgeKsize %(edgeKsize)d)"
+                  % self._qualityGovernor.quality)
+            if hasattr(self._processingFilter, 'refresh'):
+                self._processingFilter.refresh()
 
-            self._captureManager.exitFrame()
-            self._windowManager.processEvents()
+    def _printStartupProfile(self):
+        firstFrameSeconds = time.perf_counter() - self._startTime
+        parts = ['imports %.1f ms' % (_importSeconds * 1000.0)]
+        if self._capture.openSeconds is not None:
+            parts.append('device open %.1f ms' % (self._capture.openSeconds * 1000.0))
+        if self._warmupSeconds is not None:
+            parts.append('warm-up %.1f ms' % (self._warmupSeconds * 1000.0))
+        parts.append('first processed frame %.1f ms after start' % (firstFrameSeconds * 1000.0))
+        print('Startup : ' + ', '.join(parts))
+
+    def _shutDown(self):
+        if self._captureManager.isWritingVideo:
+            self._printRecordingStats(self._captureManager.stopWritingVideo())
+        self._captureManager.release()
+        if self._streamer is not None:
+            self._streamer.close()
+            self._streamer = None
+        if hasattr(self._processingFilter, 'close'):
+            self._processingFilter.close()
+        if self._windowManager is not None and self._windowManager.isWindowCreated:
+            self._windowManager.destroyWindow()
+
+    def _printRecordingStats(self, stats):
+        if stats is None:
+            return
+        print("Frames written : %(framesWritten)d, dropped : %(framesDropped)d, late : %(framesLate)d" % stats)
+        if stats['error'] is not None:
+            print("Recording failed : %s" % stats['error'])
+
+    def _outputFilename(self, extension):
+        if not os.path.isdir(self._outputDirectory):
+            os.makedirs(self._outputDirectory)
+        return os.path.join(self._outputDirectory, datetime.datetime.now().strftime('cameo-%Y%m%d-%H%M%S-%f') + extension)
 
     def onKeypress(self, keycode):
         """Handle a keypress.
@@ -39,89 +200,130 @@ class Cameo(object):
         escape -> Quit.
         """
         if keycode == 32:  # space
-            screenShotImg = input("Please enter the name of the saved screenshot : ")
-            self._captureManager.writeImage('./res/filterRes/' + screenShotImg + '.png')
+            screenShotImg = self._outputFilename('.png')
+            self._captureManager.writeImage(screenShotImg)
+            print("Screenshot saved to %s" % screenShotImg)
         elif keycode == 9:  # tab
             if not self._captureManager.isWritingVideo:
-                videoCapt = input("Please enter the name of the saved video : ")
-                self._captureManager.startWritingVideo('./res/filterRes/' + videoCapt + '.avi')
+                videoCapt = self._outputFilename('.avi')
+                self._captureManager.startWritingVideo(videoCapt, segmentSeconds=self._segmentSeconds,
+                                                       segmentBytes=self._segmentBytes)
+                print("Recording to %s" % videoCapt)
             else:
                 print("Video capture has been cancelled !")
-                self._captureManager.stopWritingVideo()
+                self._printRecordingStats(self._captureManager.stopWritingVideo())
         elif keycode == 27:  # escape
             print("Window destroyed !")
             self._windowManager.destroyWindow()
 
 class CameoDepth(Cameo):
-    def __init__(self):
-        self._windowManager = WindowManager('Cameo', self.onKeypress)
+    def __init__(self, source=0, filterChain=DEPTH_FILTERS, **kwargs):
         # Because i couldn't use the same api for the webcam as the source code i had to give the index of the camera
         # instead of creating a variable with the cv2.CAP_OPENNI2_ASUS device = cv2.CAP_OPENNI2# uncomment for Kinect
-        # device = cv2.CAP_OPENNI2_ASUS # uncomment for Xtion or Structure self._captureManager = CaptureManager(
-        # cv2.VideoCapture(device), self._windowManager, True)
+        # device = cv2.CAP_OPENNI2_ASUS # uncomment for Xtion or Structure, and pass it as the source.
+        Cameo.__init__(self, source, filterChain, **kwargs)
+        self._medianMask = depth.MedianMask()
 
-        self._captureManager = CaptureManager(cv2.VideoCapture(0), self._windowManager, True)
-        self._curveFilter = filters.FindEdgesFilter()
+    def _createCaptureManager(self, capture, isCamera, preRollBuffer):
+        # Several channels are retrieved from each frame, so there is no prefetching.
+        return CaptureManager(capture, self._windowManager, True, framePool=FramePool(), preRollBuffer=preRollBuffer)
 
-    def run(self):
-        """Run the main loop."""
-        self._windowManager.createWindow()
-        while self._windowManager.isWindowCreated:
-            self._captureManager.enterFrame()
-            self._captureManager.channel = cv2.CAP_OPENNI_DISPARITY_MAP
-            disparityMap = self._captureManager.frame
-            self._captureManager.channel = cv2.CAP_OPENNI_VALID_DEPTH_MASK
-            validDepthMask = self._captureManager.frame
-            self._captureManager.channel = cv2.CAP_OPENNI_BGR_IMAGE
+    def _processFrame(self):
+        self._captureManager.channel = cv2.CAP_OPENNI_DISPARITY_MAP
+        disparityMap = self._captureManager.frame
+        self._captureManager.channel = cv2.CAP_OPENNI_VALID_DEPTH_MASK
+        validDepthMask = self._captureManager.frame
+        self._captureManager.channel = cv2.CAP_OPENNI_BGR_IMAGE
+        frame = self._captureManager.frame
+        if frame is None:
+            # Failed to capture a BGR frame.
+            # Try to capture an infrared frame instead.
+            self._captureManager.channel = cv2.CAP_OPENNI_IR_IMAGE
             frame = self._captureManager.frame
-            if frame is None:
-                # Failed to capture a BGR frame.
-                # Try to capture an infrared frame instead.
-                self._captureManager.channel = cv2.CAP_OPENNI_IR_IMAGE
-                frame = self._captureManager.frame
-
-            if frame is not None:
-                # Make everything except the median layer black.
-                mask = depth.createMedianMask(disparityMap, validDepthMask)
-                frame[mask == 0] = 0
-
-                if self._captureManager.channel == \
-                        cv2.CAP_OPENNI_BGR_IMAGE:
-                    # A BGR frame was captured.
-                    # Apply filters to it.
-                    filters.strokeEdges(frame, frame)
-                    self._curveFilter.apply(frame, frame)
-
-            self._captureManager.exitFrame()
-            self._windowManager.processEvents()
 
-    def onKeypress(self, keycode):
-        """Handle a keypress.
-        space -> Take a screenshot.
-        tab -> Start/stop recording a screencast.
-        escape -> Quit.
-        """
-        if keycode == 32:  # space
-            screenShotImg = input("Please enter the name of the saved screenshot : ")
-            self._captureManager.writeImage('./res/filterRes/' + screenShotImg + '.png')
-        elif keycode == 9:  # tab
-            if not self._captureManager.isWritingVideo:
-                videoCapt = input("Please enter the name of the saved video : ")
-                self._captureManager.startWritingVideo('./res/filterRes/' + videoCapt + '.avi')
-            else:
-                print("Video capture has been cancelled !")
-                self._captureManager.stopWritingVideo()
-        elif keycode == 27:  # escape
-            print("Window destroyed !")
-            self._windowManager.destroyWindow()
+        if frame is not None:
+            # Make everything except the median layer black.
+            mask = self._medianMask.apply(disparityMap, validDepthMask)
+            frame[mask == 0] = 0
+
+            if self._captureManager.channel == \
+                    cv2.CAP_OPENNI_BGR_IMAGE:
+                # A BGR frame was captured.
+                # Apply filters to it.
+                self._processingFilter.apply(frame, frame)
+        return frame
+
+
+def parseFrameSize(text):
+    width, separator, height = text.lower().partition('x')
+    if not separator or not width.isdigit() or not height.isdigit():
+        raise argparse.ArgumentTypeError('expected WIDTHxHEIGHT, e.g. 1280x720')
+    return int(width), int(height)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Apply a filter chain to a camera or a video file, with a live preview.')
+    parser.add_argument('mode', nargs='?', choices=('filter', 'depth'), default='filter',
+                        help='filter (default) or depth, for a depth camera that only keeps the median depth layer')
+    parser.add_argument('--source', default='0', help='camera index or video file (default: 0)')
+    parser.add_argument('--filters', help='comma-separated filter chain (default: %s, or %s in depth mode)' % (DEFAULT_FILTERS, DEPTH_FILTERS))
+    parser.add_argument('--list-filters', action='store_true', help='list the filter names and exit')
+    parser.add_argument('--frame-size', type=parseFrameSize, help='WIDTHxHEIGHT to request from the camera, also used by --warmup')
+    parser.add_argument('--output-dir', default=OUTPUT_DIRECTORY, help='directory for screenshots and recordings')
+    parser.add_argument('--record', metavar='FILE', help='start recording to FILE right away')
+    parser.add_argument('--segment-seconds', type=float, help='split recordings into files of at most this many seconds')
+    parser.add_argument('--segment-mb', type=float,
+                        help='split recordings into files of about this many megabytes, at least %g' % (MIN_SEGMENT_BYTES / 2.0 ** 20))
+    parser.add_argument('--frames', type=int, help='stop after this many processed frames')
+    parser.add_argument('--headless', action='store_true', help='no window, stop at the end of the source')
+    parser.add_argument('--display-fps', type=float, help='refresh the preview at this rate on its own thread')
+    parser.add_argument('--stream-port', type=int, help='serve the processed frames as MJPEG over HTTP on this local port')
+    parser.add_argument('--pre-roll', type=float, default=5.0,
+                        help='seconds of frames kept for the start of each recording, 0 to disable (default: 5, cut short when --pre-roll-mb is full)')
+    parser.add_argument('--pre-roll-mb', type=float, default=DEFAULT_PRE_ROLL_MB,
+                        help='memory budget of the pre-roll in megabytes; a 1080p frame takes about 6 MB, or about a tenth with '
+                             '--pre-roll-jpeg-quality (default: %d, about 1.4 seconds of 1080p at 30 fps)' % DEFAULT_PRE_ROLL_MB)
+    parser.add_argument('--pre-roll-jpeg-quality', type=int,
+                        help='keep the pre-roll frames as JPEG data of this quality (1-100), at the cost of an encode per frame')
+    parser.add_argument('--target-fps', type=float,
+                        help='lower the strokeEdges quality to keep this frame rate, 0 to disable (default: %g for a camera, 0 for a file)'
+                        % DEFAULT_TARGET_FPS)
+    parser.add_argument('--threads', type=int, default=1, help='filter horizontal strips of the frame on this many threads')
+    parser.add_argument('--incremental', action='store_true', help='only filter again the tiles that changed since the previous frame')
+    parser.add_argument('--warmup', action='store_true', help='run the filters once at the frame size before the first frame')
+    parser.add_argument('--startup-profile', action='store_true', help='report the import, device-open, warm-up and first-frame latency')
+    args = parser.parse_args()
+
+    if args.list_filters:
+        print('\n'.join(filters.filterNames()))
+        return
+    if args.segment_mb is not None and args.segment_mb * 2 ** 20 < MIN_SEGMENT_BYTES:
+        parser.error('--segment-mb must be at least %g' % (MIN_SEGMENT_BYTES / 2.0 ** 20))
+    if args.pre_roll_mb <= 0:
+        parser.error('--pre-roll-mb must be positive, use --pre-roll 0 to disable the pre-roll')
+    if args.pre_roll_jpeg_quality is not None and not 1 <= args.pre_roll_jpeg_quality <= 100:
+        parser.error('--pre-roll-jpeg-quality must be between 1 and 100')
+    filterChain = args.filters or (DEPTH_FILTERS if args.mode == 'depth' else DEFAULT_FILTERS)
+    try:
+        filters.createFilterPipeline(filterChain)
+    except ValueError as error:
+        parser.error(str(error))
 
-check_version = input("Would you like to load filters, or depth file !\n Please type either "
-                      "Depth or Filter as an answer:")
+    cameoClass = CameoDepth if args.mode == 'depth' else Cameo
+    cameo = cameoClass(source=int(args.source) if args.source.isdigit() else args.source, filterChain=filterChain,
+                       outputDirectory=args.output_dir, frameSize=args.frame_size, headless=args.headless, displayFps=args.display_fps,
+                       streamPort=args.stream_port, preRollSeconds=args.pre_roll,
+                       preRollMaxBytes=int(args.pre_roll_mb * 2 ** 20), preRollJpegQuality=args.pre_roll_jpeg_quality,
+                       targetFps=args.target_fps, threadCount=args.threads, incremental=args.incremental, warmup=args.warmup, maxFrames=args.frames,
+                       recordFilename=args.record, startupProfile=args.startup_profile, startTime=_importStart, segmentSeconds=args.segment_seconds,
+                       segmentBytes=int(args.segment_mb * 2 ** 20) if args.segment_mb else None)
+    try:
+        cameo.run()
+    except KeyboardInterrupt:
+        pass  # run has already released the capture and flushed the writers.
+    except IOError as error:
+        parser.exit(1, '%s: error: %s\n' % (parser.prog, error))
 
-if check_version.lower() == "depth":
-    if __name__ == "__main__":
-        CameoDepth().run()
 
-elif check_version.lower() == "filter":
-    if __name__ == "__main__":
-        Cameo().run()
+if __name__ == '__main__':
+    main()
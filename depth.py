@@ -1,3 +1,4 @@
+import cv2
 import numpy as np
 
 """
@@ -23,3 +24,154 @@ argument is assigned to to the corrrespondig element in the output array. Conver
 argument is assigned to the corresponding element in the outpyt array.  
 """
 
+
+"""
+createMedianMask is simple but does more work than it needs to on every frame: np.median partially sorts the whole disparity map, and np.where builds
+an int64 array before it is converted to 8 bits. MedianMask computes the same mask with less work, and reuses its output array from frame to frame:
+    - For 8-bit disparity maps (what cv2.CAP_OPENNI_DISPARITY_MAP gives), the median comes from a 256-bin histogram (cv2.calcHist), in linear time. With
+      an even number of pixels it is the average of the two middle values, exactly like np.median. Other depths fall back to np.median.
+    - |disparity - median| < threshold is evaluated as a range check, median - threshold < disparity < median + threshold, with cv2.inRange, so no
+      subtraction is made in the map's own (possibly unsigned) type. Pixels outside the valid depth mask are added with cv2.compare and cv2.bitwise_or.
+    - With temporalSmoothing > 0, the histogram is an exponential moving average over frames (temporalSmoothing is the weight of the previous frames),
+      updated incrementally from the previous frame's histogram, and the median is that of the smoothed histogram. This keeps the selected layer from
+      flickering when the median jumps between frames. It only applies to 8-bit maps and rects of a constant size.
+With temporalSmoothing = 0, MedianMask.apply returns exactly what createMedianMask returns, but in an array that the next call overwrites.
+"""
+
+class MedianMask(object):
+
+    def __init__(self, threshold=12, temporalSmoothing=0.0):
+        self.threshold = threshold
+        self.temporalSmoothing = temporalSmoothing
+        self._median = None  # Non public variable
+        self._histogram = None  # Non public variable
+        self._histogramShape = None  # Non public variable
+        self._mask = None  # Non public variable
+        self._invalidMask = None  # Non public variable
+
+    @property
+    def median(self):
+        """The median used for the last mask."""
+        return self._median
+
+    def reset(self):
+        """Forget the smoothed histogram, e.g. after a scene change."""
+        self._histogram = None
+
+    def apply(self, disparityMap, validDepthMask, rect=None):
+        """Return a mask selecting the median layer, plus shadows. The returned array is reused by the next call."""
+        if rect is not None:
+            x, y, w, h = rect
+            disparityMap = disparityMap[y:y+h, x:x+w]
+            validDepthMask = validDepthMask[y:y+h, x:x+w]
+
+        if disparityMap.dtype == np.uint8:
+            median = self._histogramMedian(disparityMap)
+        else:
+            self._histogram = None
+            median = np.median(disparityMap)
+        self._median = median
+
+        if self._mask is None or self._mask.shape != disparityMap.shape:
+            self._mask = np.empty(disparityMap.shape, np.uint8)
+            self._invalidMask = np.empty(disparityMap.shape, np.uint8)
+
+        # inRange is inclusive, so turn the strict bounds into the nearest values inside them.
+        lower, upper = median - self.threshold, median + self.threshold
+        if np.issubdtype(disparityMap.dtype, np.integer):
+            lower, upper = np.floor(lower) + 1, np.ceil(upper) - 1
+        else:
+            lower, upper = np.nextafter(lower, np.inf), np.nextafter(upper, -np.inf)
+        cv2.inRange(disparityMap, float(lower), float(upper), self._mask)
+        cv2.compare(validDepthMask, 0, cv2.CMP_EQ, self._invalidMask)
+        cv2.bitwise_or(self._mask, self._invalidMask, self._mask)
+        return self._mask
+
+    def _histogramMedian(self, disparityMap):
+        # In float64, so that the smoothed histogram keeps its total over many frames.
+        histogram = cv2.calcHist([disparityMap], [0], None, [256], [0, 256]).ravel().astype(np.float64)
+        # The history only applies to a region of the same size, which the shape tells exactly (unlike the sums of the fractional counts).
+        if self.temporalSmoothing > 0.0 and self._histogram is not None and self._histogramShape == disparityMap.shape:
+            histogram = self.temporalSmoothing * self._histogram + (1.0 - self.temporalSmoothing) * histogram
+            self._histogram = histogram
+            # The smoothed counts are fractional, so take the value at which half of the weight is reached.
+            return float(np.searchsorted(np.cumsum(histogram), 0.5 * histogram.sum()))
+        self._histogram = histogram
+        self._histogramShape = disparityMap.shape
+
+        cumulative = np.cumsum(histogram)
+        count = int(cumulative[-1])
+        lower = np.searchsorted(cumulative, (count - 1) // 2, side='right')
+        upper = np.searchsorted(cumulative, count // 2, side='right')
+        return (lower + upper) / 2.0
+
+
+"""
+createMedianMasks is the batched counterpart of createMedianMask, for segmenting several regions of interest and/or a stack of buffered frames at once. It
+takes N disparity maps and valid depth masks stacked into (N, H, W) arrays and a list of R rects (x, y, w, h), and fills one (N, R, H, W) uint8 array in
+which masks[n, r] is the mask of rect r in frame n, at the rect's position in the frame, and 0 outside the rect. It also returns the (N, R) medians.
+Instead of N x R calls, each rect is handled in one vectorized pass over the whole stack: the medians of all N frames come from their histograms (8-bit
+maps, all N from one cv2.calcHist call) or from one np.median along the stack, and the N masks are thresholded together, with per-frame bounds broadcast
+over the rect. Both output arrays can be passed in to be reused across calls.
+"""
+
+def _stackedHistograms(regions):
+    """Return the 256-bin histograms of a (N, H, W) stack of 8-bit regions, as the 2-D histogram of (region index, value) over the regions laid end to
+    end, which takes one cv2.calcHist call per 256 regions instead of one per region."""
+    count, height, width = regions.shape
+    histograms = np.empty((count, 256), np.float32)
+    for start in range(0, count, 256):
+        chunk = np.ascontiguousarray(regions[start:start + 256])
+        chunkCount = chunk.shape[0]
+        indices = np.empty(chunk.shape, np.uint8)
+        indices[...] = np.arange(chunkCount, dtype=np.uint8)[:, np.newaxis, np.newaxis]
+        histograms[start:start + chunkCount] = cv2.calcHist([indices.reshape(-1, width), chunk.reshape(-1, width)], [0, 1], None,
+                                                            [chunkCount, 256], [0, chunkCount, 0, 256])
+    return histograms
+
+
+def createMedianMasks(disparityMaps, validDepthMasks, rects=None, threshold=12, masks=None, medians=None):
+    """Return (masks, medians) for every rect in every frame of a stack of disparity maps."""
+    disparityMaps = np.asarray(disparityMaps)
+    validDepthMasks = np.asarray(validDepthMasks)
+    if disparityMaps.ndim != 3 or validDepthMasks.shape != disparityMaps.shape:
+        raise ValueError('expected two (N, H, W) stacks of the same shape')
+    count, height, width = disparityMaps.shape
+    if rects is None:
+        rects = [(0, 0, width, height)]
+
+    if masks is None:
+        masks = np.zeros((count, len(rects), height, width), np.uint8)
+    elif masks.shape != (count, len(rects), height, width) or masks.dtype != np.uint8:
+        raise ValueError('masks must be a uint8 array of shape %r' % ((count, len(rects), height, width),))
+    else:
+        masks[...] = 0
+    if medians is None:
+        medians = np.empty((count, len(rects)))
+
+    for index, (x, y, w, h) in enumerate(rects):
+        regions = disparityMaps[:, y:y+h, x:x+w]
+        validRegions = validDepthMasks[:, y:y+h, x:x+w]
+        pixelCount = regions.shape[1] * regions.shape[2]
+        if pixelCount == 0:
+            medians[:, index] = np.nan
+            continue
+
+        if disparityMaps.dtype == np.uint8:
+            histograms = _stackedHistograms(regions)
+            cumulative = np.cumsum(histograms, axis=1)
+            lower = np.argmax(cumulative > (pixelCount - 1) // 2, axis=1)
+            upper = np.argmax(cumulative > pixelCount // 2, axis=1)
+            regionMedians = (lower + upper) / 2.0
+        else:
+            regionMedians = np.median(regions.reshape(count, -1), axis=1)
+        medians[:, index] = regionMedians
+
+        # |disparity - median| < threshold as a range check with per-frame bounds, like MedianMask.apply.
+        lowerBounds = (regionMedians - threshold)[:, np.newaxis, np.newaxis]
+        upperBounds = (regionMedians + threshold)[:, np.newaxis, np.newaxis]
+        selected = (regions > lowerBounds) & (regions < upperBounds)
+        selected |= validRegions == 0
+        np.multiply(selected, 255, out=masks[:, index, y:y+h, x:x+w], casting='unsafe')
+
+    return masks, medians
@@ -1,3 +1,7 @@
+import concurrent.futures
+import copy
+import os
+import time
 import cv2
 import numpy as np
 
@@ -39,12 +43,219 @@ def strokeEdges(src, dst, blurKsize=7, edgeKsize=5):
     cv2.merge(channels, dst)
 
 
+# strokeEdges allocates a float64 alpha array, splits the frame, multiplies each channel through a float temporary and merges the channels back, so every call
+# makes several full-frame allocations. StrokeEdgesFilter is a drop-in replacement for the main loop: it keeps its scratch buffers between calls (they are
+# reallocated only when the frame shape changes), writes each OpenCV step into them, and blends all three channels in a single cv2.multiply call.
+#
+# strokeEdges truncates channel * alpha towards zero, whereas cv2.multiply rounds to the nearest integer, so the fast blend can be 1 higher than strokeEdges
+# per channel value (never lower, and never more than 1). With exact=True the blend instead goes through a 64 KiB table built with strokeEdges' own float
+# arithmetic. That is byte-identical to strokeEdges and makes no full-frame allocation (the table index is kept in an intp buffer, which np.take uses as
+# is, whereas a narrower index would be converted to a temporary intp array on every call). But the lookup is a gather, which is slower than strokeEdges'
+# own float blend (about 1.5 times at 360p with blurKsize=0), so exact=True is only worth it when the output must match strokeEdges byte for byte.
+#
+# With pyramidLevel > 0, the blur and edge steps run on a copy of the frame downscaled by 2 ** pyramidLevel (cv2.resize with INTER_AREA), and the resulting
+# alpha map is upsampled with bilinear interpolation and blended with the full-resolution frame. Each level divides the cost of medianBlur and Laplacian by
+# about 4, at the price of softer, thicker strokes (the ksizes apply to the downscaled frame, so they cover 2 ** pyramidLevel times as many source pixels).
+# The downscaled grid depends on where the frame starts and on its size being a multiple of 2 ** pyramidLevel, so a part of the frame only gives the same
+# output as the whole frame if it starts and ends on that grid too. alignment is that multiple, which TiledFilter and IncrementalFilter respect.
+
+class StrokeEdgesFilter(object):
+    _exactTable = None  # Shared (255 - gray, channel) -> blended value table for exact=True
+
+    def __init__(self, blurKsize=7, edgeKsize=5, exact=False, pyramidLevel=0):
+        self.blurKsize = blurKsize
+        self.edgeKsize = edgeKsize
+        self.exact = exact
+        self.pyramidLevel = pyramidLevel
+        self._shape = None  # Non public variable
+        self._blurredSrc = None  # Non public variable
+        self._graySrc = None  # Non public variable
+        self._inverseAlpha = None  # Non public variable
+        self._tableIndex = None  # Non public variable
+        self._pyramidLevel = None  # Non public variable
+        self._smallSrc = None  # Non public variable
+        self._smallGraySrc = None  # Non public variable
+
+    def _allocate(self, shape):
+        height, width = shape[:2]
+        self._shape = shape
+        self._blurredSrc = np.empty(shape, np.uint8)
+        self._graySrc = np.empty((height, width), np.uint8)
+        self._inverseAlpha = np.empty(shape, np.uint8)
+        self._tableIndex = None
+        self._pyramidLevel = None
+
+    def _allocateLevel(self, shape, pyramidLevel):
+        factor = 1 << pyramidLevel
+        smallShape = ((shape[0] + factor - 1) // factor, (shape[1] + factor - 1) // factor) + tuple(shape[2:])
+        self._pyramidLevel = pyramidLevel
+        self._smallSrc = np.empty(smallShape, np.uint8)
+        self._blurredSrc = np.empty(smallShape, np.uint8)
+        self._smallGraySrc = np.empty(smallShape[:2], np.uint8)
+
+    @property
+    def radius(self):  # How many pixels around each output pixel the filter reads
+        radius = (self.blurKsize // 2 if self.blurKsize >= 3 else 0) + _laplacianRadius(self.edgeKsize)
+        if self.pyramidLevel > 0:
+            # Each downscaled pixel covers 2 ** pyramidLevel source pixels, and the upsampling reads one more.
+            radius = (radius + 1) << self.pyramidLevel
+        return radius
+
+    @property
+    def alignment(self):  # The multiple of rows and columns that a part of the frame must start and end at, to be filtered like the whole frame
+        return 1 << self.pyramidLevel
+
+    def apply(self, src, dst):  # Apply the filter with a BGR source/destination, which may be the same array
+        if src.shape != self._shape:
+            self._allocate(src.shape)
+
+        graySrc = self._graySrc
+        if self.pyramidLevel > 0:
+            if self.pyramidLevel != self._pyramidLevel:
+                self._allocateLevel(src.shape, self.pyramidLevel)
+            smallSrc = self._smallSrc
+            cv2.resize(src, (smallSrc.shape[1], smallSrc.shape[0]), smallSrc, interpolation=cv2.INTER_AREA)
+            self._strokeAlpha(smallSrc, self._smallGraySrc)
+            cv2.resize(self._smallGraySrc, (graySrc.shape[1], graySrc.shape[0]), graySrc, interpolation=cv2.INTER_LINEAR)
+        else:
+            if self._pyramidLevel is not None:
+                self._allocate(src.shape)
+            self._strokeAlpha(src, graySrc)
+
+        if self.exact:
+            self._blendExact(src, dst)
+        else:
+            cv2.cvtColor(graySrc, cv2.COLOR_GRAY2BGR, self._inverseAlpha)
+            cv2.multiply(src, self._inverseAlpha, dst, 1.0 / 255)
+
+    def _strokeAlpha(self, src, graySrc):  # Write the inverse edge map, 255 - Laplacian, of src into graySrc
+        if self.blurKsize >= 3:
+            cv2.medianBlur(src, self.blurKsize, self._blurredSrc)
+            cv2.cvtColor(self._blurredSrc, cv2.COLOR_BGR2GRAY, graySrc)
+        else:
+            cv2.cvtColor(src, cv2.COLOR_BGR2GRAY, graySrc)
+
+        cv2.Laplacian(graySrc, cv2.CV_8U, graySrc, ksize=self.edgeKsize)
+        cv2.bitwise_not(graySrc, graySrc)
+
+    def _blendExact(self, src, dst):
+        if StrokeEdgesFilter._exactTable is None:
+            inverseAlpha = np.arange(256)[:, np.newaxis]
+            channel = np.arange(256, dtype=np.uint8)[np.newaxis, :]
+            StrokeEdgesFilter._exactTable = (channel * ((1.0 / 255) * inverseAlpha)).astype(np.uint8).ravel()
+        if self._tableIndex is None:
+            self._tableIndex = np.empty(self._shape, np.intp)
+        # Index the table with (255 - gray) << 8 | channel for all three channels at once.
+        tableIndex = self._tableIndex
+        np.left_shift(self._graySrc[..., np.newaxis], 8, out=tableIndex, dtype=np.intp)
+        np.bitwise_or(tableIndex, src, out=tableIndex)
+        np.take(StrokeEdgesFilter._exactTable, tableIndex, out=dst, mode='clip')
+
+
+# QualityGovernor keeps a StrokeEdgesFilter real-time on hardware that cannot run it at full quality. The application reports the time it spent on each
+# frame and the governor compares its exponential moving average with the budget of the target frame rate. After holdFrames consecutive frames over budget,
+# it steps down to the next (cheaper) quality level; after holdFrames consecutive frames under headroom times the budget, it steps back up. The band between
+# headroom and 1, the hold, and a fresh average after every change keep the level from oscillating between two neighbours; if a step up still has to be
+# undone, the hold before the next step up doubles (up to 32 times holdFrames). Each level of QUALITY_LEVELS is a
+# (pyramidLevel, blurKsize, edgeKsize) setting of the filter, from the best to the cheapest. For 8-bit frames, medianBlur uses a much slower algorithm
+# above ksize 5 (about 20 times slower at ksize 7), so the default levels first trade resolution for blurKsize=7 and only then drop to blurKsize=5.
+
+QUALITY_LEVELS = (
+    (0, 7, 5),
+    (1, 7, 5),
+    (2, 7, 5),
+    (0, 5, 5),
+    (1, 5, 5),
+    (1, 3, 3),
+)
+
+
+class QualityGovernor(object):
+
+    def __init__(self, strokeEdgesFilter, targetFps=30.0, levels=QUALITY_LEVELS, headroom=0.7, holdFrames=15, smoothing=0.2):
+        self.targetFps = targetFps
+        self.headroom = headroom
+        self.holdFrames = holdFrames
+        self.smoothing = smoothing
+        self._filter = strokeEdgesFilter  # Non public variable
+        self._levels = tuple(levels)  # Non public variable
+        self._level = None  # Non public variable
+        self._smoothedFrameTime = None  # Non public variable
+        self._framesOver = 0  # Non public variable
+        self._framesUnder = 0  # Non public variable
+        self._levelChanges = 0  # Non public variable
+        self._lastStep = 0  # Non public variable
+        self._upHoldFrames = holdFrames  # Non public variable
+        self.level = 0
+
+    @property
+    def level(self):  # Index into the quality levels, 0 being the best
+        return self._level
+
+    @level.setter
+    def level(self, value):
+        value = max(0, min(value, len(self._levels) - 1))
+        if value != self._level:
+            self._level = value
+            self._filter.pyramidLevel, self._filter.blurKsize, self._filter.edgeKsize = self._levels[value]
+            self._smoothedFrameTime = None
+            self._framesOver = 0
+            self._framesUnder = 0
+
+    @property
+    def quality(self):
+        """Return the current level and the filter settings it stands for, as a dict."""
+        pyramidLevel, blurKsize, edgeKsize = self._levels[self._level]
+        return {'level': self._level, 'pyramidLevel': pyramidLevel, 'blurKsize': blurKsize, 'edgeKsize': edgeKsize,
+                'frameTimeMs': None if self._smoothedFrameTime is None else self._smoothedFrameTime * 1000.0,
+                'levelChanges': self._levelChanges}
+
+    def update(self, frameTime):
+        """Record the seconds spent on the last frame and step the quality level if needed. Return True if the level changed."""
+        if frameTime is None:
+            return False
+        if self._smoothedFrameTime is None:
+            self._smoothedFrameTime = frameTime
+        else:
+            self._smoothedFrameTime += self.smoothing * (frameTime - self._smoothedFrameTime)
+
+        budget = 1.0 / self.targetFps
+        if self._smoothedFrameTime > budget:
+            self._framesOver += 1
+            self._framesUnder = 0
+        elif self._smoothedFrameTime < self.headroom * budget:
+            self._framesUnder += 1
+            self._framesOver = 0
+        else:
+            self._framesOver = 0
+            self._framesUnder = 0
+
+        level = self._level
+        if self._framesOver >= self.holdFrames and level < len(self._levels) - 1:
+            if self._lastStep < 0:
+                # The last step up did not fit in the budget, so wait longer before trying again.
+                self._upHoldFrames = min(self._upHoldFrames * 2, self.holdFrames * 32)
+            self.level = level + 1
+            self._lastStep = 1
+        elif self._framesUnder >= self._upHoldFrames and level > 0:
+            self.level = level - 1
+            self._lastStep = -1
+        if self._level != level:
+            self._levelChanges += 1
+            return True
+        return False
+
+
 # We add now  two classes 'VConvolutionFilter, will represent a convolution filter in general. A subclass, SharpenFilter, will represent our sharpening flter specifically.
 
 class VConvolutionFilter(object):  # Applies a convolution to V (or all of BGR)
     def __init__(self, kernel):
         self._kernel = kernel
 
+    @property
+    def radius(self):  # How many pixels around each output pixel the filter reads
+        return max(np.shape(self._kernel)) // 2
+
     def apply(self, src, dst):  # Apply the filter with a BGR or gray source/destination
         cv2.filter2D(src, -1, self._kernel, dst)
 
@@ -104,4 +315,507 @@ class exoFilter(VConvolutionFilter):
         kernel = np.array([[1, 0, -1],
                            [0, 0, 0],
                            [-1, 0, 1]])
-        VConvolutionFilter.__init__(self, kernel)
\ No newline at end of file
+        VConvolutionFilter.__init__(self, kernel)
+
+# FilterPipeline applies a sequence of filters as one object with the same apply(src, dst) interface. Any object with an apply(src, dst) method, or any
+# function taking (src, dst) like strokeEdges, can be part of the pipeline. Runs of consecutive VConvolutionFilters are compiled into an execution plan the first
+# time a given frame type is seen:
+#    - Consecutive kernels are fused into one equivalent kernel where that is mathematically valid and cheaper than two passes. Validity needs a
+#      floating-point frame, because with 8-bit frames every filter2D pass rounds and saturates its output, and a kernel that is symmetric under
+#      horizontal and vertical flips ahead of the next one, because only then does filtering the reflected border (OpenCV's default BORDER_REFLECT_101)
+#      give the reflection of the filtered frame.
+#    - Rank-1 kernels, such as BlurFilter's 5x5 box, run as two 1-D passes with sepFilter2D.
+#    - Other kernels run with filter2D, which convolves directly or, for large kernels, through the DFT. The cost of either is used to decide on fusion.
+# applySequential runs the same filters one at a time, as Cameo used to, and serves as the reference. With 8-bit frames the pipeline matches it exactly.
+# With floating-point frames, fused and separable stages sum their products in a different order than filter2D, so they agree with it only up to
+# floating point rounding (e.g. about 1e-4 with BlurFilter on float32 frames).
+
+class FilterPipeline(object):
+    # Kernel areas from which cv2.filter2D uses its DFT-based algorithm, for 8-bit and for other frames, and the rough per-pixel cost of that
+    # algorithm in multiply-adds per log2(transform area). Explicit cv2.dft stages were measured slower than filter2D's own DFT path at every
+    # kernel size, so the pipeline leaves that switch to filter2D and only uses the costs to decide on fusion.
+    DFT_KERNEL_AREA_8U = 130
+    DFT_KERNEL_AREA = 50
+    DFT_COST_FACTOR = 6.0
+
+    def __init__(self, filters, separableTolerance=1e-6):
+        self._filters = list(filters)
+        self._separableTolerance = separableTolerance  # Non public variable
+        self._plans = {}  # Non public variable
+
+    @property
+    def filters(self):
+        return list(self._filters)
+
+    @property
+    def radius(self):  # How many pixels around each output pixel the whole pipeline reads
+        return sum(filterRadius(aFilter) for aFilter in self._filters)
+
+    @property
+    def alignment(self):  # The multiple of rows and columns that a part of the frame must start and end at, to be filtered like the whole frame
+        return int(np.lcm.reduce([filterAlignment(aFilter) for aFilter in self._filters] + [1]))
+
+    def apply(self, src, dst):  # Apply every filter in turn, src and dst may be the same array
+        plan = self._plans.get((src.shape, src.dtype))
+        if plan is None:
+            plan = self._compile(src.shape, src.dtype)
+            self._plans[(src.shape, src.dtype)] = plan
+
+        current = src
+        for stage in plan:
+            stage(current, dst)
+            current = dst
+        if not plan:
+            dst[...] = src
+
+    def applySequential(self, src, dst):  # Reference: apply the filters one at a time without any optimization
+        current = src
+        for aFilter in self._filters:
+            _applyFilter(aFilter, current, dst)
+            current = dst
+        if not self._filters:
+            dst[...] = src
+
+    def describe(self, shape, dtype):
+        """Return a list of strings describing how frames of the given shape and dtype are processed."""
+        plan = self._plans.get((shape, np.dtype(dtype)))
+        if plan is None:
+            plan = self._compile(shape, np.dtype(dtype))
+        return [stage.description for stage in plan]
+
+    def _compile(self, shape, dtype):
+        stages = []
+        kernels = []
+        for aFilter in self._filters:
+            if isinstance(aFilter, VConvolutionFilter):
+                kernels.append(np.asarray(aFilter._kernel, np.float64))
+            else:
+                stages.extend(self._compileKernels(kernels, shape, dtype))
+                kernels = []
+                stages.append(_CallStage(aFilter))
+        stages.extend(self._compileKernels(kernels, shape, dtype))
+        return stages
+
+    def _compileKernels(self, kernels, shape, dtype):
+        if not kernels:
+            return []
+        stages = [self._kernelStage(kernels[0], shape, dtype)]
+        for kernel in kernels[1:]:
+            stage = self._kernelStage(kernel, shape, dtype)
+            previous = stages[-1]
+            if np.issubdtype(dtype, np.floating) and _isFlipSymmetric(previous.kernel) and \
+                    _canFuse(previous.kernel, kernel, shape):
+                # Only keep the fused kernel if it is cheaper than the two passes.
+                fusedStage = self._kernelStage(_composeKernels(previous.kernel, kernel), shape, dtype)
+                if fusedStage.cost < previous.cost + stage.cost:
+                    stages[-1] = fusedStage
+                    continue
+            stages.append(stage)
+        return stages
+
+    def _kernelStage(self, kernel, shape, dtype):
+        u, s, vt = np.linalg.svd(kernel)
+        if s.size > 1 and s[1] <= self._separableTolerance * s[0]:
+            scale = np.sqrt(s[0])
+            return _SeparableStage(kernel, vt[0] * scale, u[:, 0] * scale)
+
+        # filter2D switches to a DFT-based algorithm by itself once the kernel area reaches a threshold that depends on the depth.
+        dftKernelArea = self.DFT_KERNEL_AREA_8U if dtype == np.uint8 else self.DFT_KERNEL_AREA
+        if kernel.size >= dftKernelArea and kernel.shape[0] <= shape[0] and kernel.shape[1] <= shape[1]:
+            transformArea = cv2.getOptimalDFTSize(shape[0] + kernel.shape[0] - 1) * \
+                cv2.getOptimalDFTSize(shape[1] + kernel.shape[1] - 1)
+            return _DirectStage(kernel, self.DFT_COST_FACTOR * np.log2(transformArea), 'DFT')
+        return _DirectStage(kernel, kernel.size, 'direct')
+
+
+def filterRadius(aFilter):
+    """Return how many pixels around each output pixel aFilter reads, from its radius attribute or, for strokeEdges, its default arguments."""
+    if aFilter is strokeEdges:
+        return 7 // 2 + _laplacianRadius(5)
+    radius = getattr(aFilter, 'radius', None)
+    if radius is None:
+        raise ValueError('cannot tell the radius of %r, give it explicitly' % (aFilter,))
+    return radius
+
+
+def filterAlignment(aFilter):
+    """Return the multiple of rows and columns that a part of the frame must start and end at for aFilter to filter it like the whole frame, from its
+    alignment attribute (1 if it has none)."""
+    return getattr(aFilter, 'alignment', 1)
+
+
+def _alignDown(value, alignment):
+    return value - value % alignment
+
+
+def _alignUp(value, alignment):
+    return -(-value // alignment) * alignment
+
+
+def _laplacianRadius(ksize):
+    # With ksize=1, Laplacian uses a 3x3 aperture.
+    return max(ksize // 2, 1)
+
+
+def _applyFilter(aFilter, src, dst):
+    if hasattr(aFilter, 'apply'):
+        aFilter.apply(src, dst)
+    else:
+        aFilter(src, dst)
+
+
+def _isFlipSymmetric(kernel):
+    return np.allclose(kernel, kernel[::-1, :], rtol=0, atol=1e-12) and \
+        np.allclose(kernel, kernel[:, ::-1], rtol=0, atol=1e-12)
+
+
+def _canFuse(first, second, shape):
+    # Both kernels need an anchor at their centre, and the frame must be larger than the fused kernel for the reflected border to stay valid.
+    height = first.shape[0] + second.shape[0] - 1
+    width = first.shape[1] + second.shape[1] - 1
+    return all(size % 2 == 1 for size in first.shape + second.shape) and shape[0] > height and shape[1] > width
+
+
+def _composeKernels(first, second):
+    """Return the kernel equivalent to filtering with first, then with second (filter2D correlates, so this is their full convolution)."""
+    fused = np.zeros((first.shape[0] + second.shape[0] - 1, first.shape[1] + second.shape[1] - 1))
+    for (y, x), weight in np.ndenumerate(first):
+        fused[y:y + second.shape[0], x:x + second.shape[1]] += weight * second
+    return fused
+
+
+# Each stage has a description for FilterPipeline.describe and, for kernel stages, the kernel it applies and its cost in multiply-adds per pixel.
+
+class _CallStage(object):
+    def __init__(self, aFilter):
+        self._filter = aFilter
+        self.description = 'call %s' % getattr(aFilter, '__name__', type(aFilter).__name__)
+
+    def __call__(self, src, dst):
+        _applyFilter(self._filter, src, dst)
+
+
+class _DirectStage(object):
+    def __init__(self, kernel, cost, algorithm):
+        self.kernel = kernel
+        self.cost = cost
+        self.description = 'filter2D %dx%d (%s)' % (kernel.shape[1], kernel.shape[0], algorithm)
+
+    def __call__(self, src, dst):
+        cv2.filter2D(src, -1, self.kernel, dst)
+
+
+class _SeparableStage(object):
+    def __init__(self, kernel, kernelX, kernelY):
+        self.kernel = kernel
+        self.cost = kernelX.size + kernelY.size
+        self._kernelX = kernelX
+        self._kernelY = kernelY
+        self.description = 'sepFilter2D %d+%d' % (kernelX.size, kernelY.size)
+
+    def __call__(self, src, dst):
+        cv2.sepFilter2D(src, -1, self._kernelX, self._kernelY, dst)
+
+
+# TiledFilter runs a filter on horizontal strips of the frame in a thread pool. OpenCV releases the GIL while it filters, so on large frames the strips
+# are processed on several cores at once. Each strip is filtered together with radius extra rows above and below it (its halo), so that its own rows see
+# exactly the same neighbourhood as in an untiled call, and the output is bit-exact (except with kernels large enough for filter2D to switch to its DFT
+# algorithm, whose rounding depends on the image size, so results may then differ by 1). At the top and bottom of the frame the strip reaches the frame
+# border, where the filter applies its usual border extrapolation. The halo is taken from filterRadius, which adds up the kernel radius of every
+# filter2D, medianBlur and Laplacian step (e.g. 3 + 2 rows for strokeEdges with its default ksizes), unless it is given explicitly. For a filter with an
+# alignment (a StrokeEdgesFilter with pyramidLevel > 0), the strips and their halos start and end on multiples of it, and a frame whose height is not a
+# multiple of it is filtered in one piece.
+#
+# OpenCV writes a filtered image of the same size as its input, so each strip is filtered into a scratch buffer of its own (kept between calls) and its
+# rows are then copied into dst. When src and dst are the same array, which is how Cameo applies its filters, the copies wait until every strip has been
+# filtered, since a strip's halo rows are another strip's output rows. Each strip also gets its own copy of the filter, because filters like
+# StrokeEdgesFilter keep scratch buffers and cannot be shared between threads.
+
+class TiledFilter(object):
+
+    def __init__(self, aFilter, tileCount=None, threadCount=None, radius=None):
+        self._filter = aFilter  # Non public variable
+        self.threadCount = threadCount or os.cpu_count() or 1
+        self.tileCount = tileCount or self.threadCount
+        self.radius = filterRadius(aFilter) if radius is None else radius
+        self._fixedRadius = radius  # Non public variable
+        self._executor = None  # Non public variable
+        self._executorThreads = None  # Non public variable
+        self._stripFilters = []  # Non public variable
+        self._stripBuffers = []  # Non public variable
+
+    @property
+    def alignment(self):
+        return filterAlignment(self._filter)
+
+    def _strips(self, height, alignment):
+        if height % alignment:
+            return [(0, height)]
+        tileCount = max(1, min(self.tileCount, height // alignment))
+        bounds = np.linspace(0, height // alignment, tileCount + 1).astype(int) * alignment
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    def _filterStrip(self, index, src, top, bottom, alignment):
+        halo = _alignUp(self.radius, alignment)
+        haloTop = max(top - halo, 0)
+        haloBottom = min(bottom + halo, src.shape[0])
+        srcStrip = src[haloTop:haloBottom]
+        buffer = self._stripBuffers[index]
+        if buffer is None or buffer.shape != srcStrip.shape or buffer.dtype != srcStrip.dtype:
+            buffer = np.empty_like(srcStrip)
+            self._stripBuffers[index] = buffer
+        _applyFilter(self._stripFilters[index], srcStrip, buffer)
+        return buffer[top - haloTop:bottom - haloTop]
+
+    def apply(self, src, dst):  # Apply the filter strip by strip, src and dst may be the same array
+        alignment = self.alignment
+        strips = self._strips(src.shape[0], alignment)
+        if len(strips) == 1:
+            _applyFilter(self._filter, src, dst)
+            return
+
+        if self._executor is None or self._executorThreads != self.threadCount:
+            if self._executor is not None:
+                self._executor.shutdown()
+            self._executor = concurrent.futures.ThreadPoolExecutor(self.threadCount, thread_name_prefix='TiledFilter')
+            self._executorThreads = self.threadCount
+        while len(self._stripFilters) < len(strips):
+            self._stripFilters.append(copy.deepcopy(self._filter))
+            self._stripBuffers.append(None)
+
+        inPlace = np.may_share_memory(src, dst)
+
+        def filterStrip(index):
+            top, bottom = strips[index]
+            rows = self._filterStrip(index, src, top, bottom, alignment)
+            if not inPlace:
+                dst[top:bottom] = rows
+            return rows
+
+        results = list(self._executor.map(filterStrip, range(len(strips))))
+        if inPlace:
+            def copyStrip(index):
+                top, bottom = strips[index]
+                dst[top:bottom] = results[index]
+            list(self._executor.map(copyStrip, range(len(strips))))
+
+    def refresh(self):
+        """Copy the filter again for each strip on the next call, e.g. after its parameters changed, which may also change its radius."""
+        self._stripFilters = []
+        self._stripBuffers = []
+        if hasattr(self._filter, 'refresh'):
+            self._filter.refresh()
+        if self._fixedRadius is None:
+            self.radius = filterRadius(self._filter)
+
+    def close(self):
+        """Stop the worker threads."""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+
+# IncrementalFilter skips the work on the parts of the frame that did not change, which with a fixed camera is most of it. It keeps the last source frame that
+# each output region was computed from, and for every new frame it counts, per tile, the channel values that differ from it by more than threshold (one
+# absdiff, one threshold and one integral image, about 2 ms at 720p). Tiles with at least minChangedValues such values have changed. Since an output pixel
+# depends on the source pixels within the filter's radius, the changed tiles are dilated by enough tiles to cover the radius, and each run of dirty tiles in a
+# tile row is filtered again, together with a halo of radius pixels, like a strip in TiledFilter (and with the same bit-exactness). All the other pixels are
+# copied from the cached output of earlier frames. For a filter with an alignment, the halos are widened to start and end on multiples of it, and a frame
+# whose width or height is not a multiple of it is filtered whole every time.
+#
+# Changes below the threshold are not recomputed, but they still count against the reference frame, so a slow drift is caught once it adds up. Every
+# refreshInterval frames (and after refresh or reset is called, e.g. when the filter's parameters changed), the whole frame is filtered again regardless.
+# changedTileRatio is the fraction of tiles that the last frame recomputed, 1.0 for a full refresh.
+
+class IncrementalFilter(object):
+
+    def __init__(self, aFilter, tileSize=64, threshold=8, minChangedValues=4, refreshInterval=30, radius=None):
+        self._filter = aFilter  # Non public variable
+        self.tileSize = tileSize
+        self.threshold = threshold
+        self.minChangedValues = minChangedValues
+        self.refreshInterval = refreshInterval
+        self.radius = filterRadius(aFilter) if radius is None else radius
+        self._fixedRadius = radius  # Non public variable
+        self._reference = None  # Non public variable
+        self._output = None  # Non public variable
+        self._difference = None  # Non public variable
+        self._integral = None  # Non public variable
+        self._scratch = {}  # Non public variable
+        self._framesSinceRefresh = 0  # Non public variable
+        self._frames = 0  # Non public variable
+        self._fullRefreshes = 0  # Non public variable
+        self._tilesRecomputed = 0  # Non public variable
+        self._tilesTotal = 0  # Non public variable
+        self._changedTileRatio = None  # Non public variable
+
+    @property
+    def changedTileRatio(self):
+        return self._changedTileRatio
+
+    def stats(self):
+        """Return the number of frames and full refreshes, and the last and mean fraction of tiles recomputed."""
+        return {
+            'frames': self._frames,
+            'fullRefreshes': self._fullRefreshes,
+            'changedTileRatio': self._changedTileRatio,
+            'meanChangedTileRatio': self._tilesRecomputed / self._tilesTotal if self._tilesTotal else None,
+        }
+
+    def refresh(self):
+        """Filter the whole of the next frame, e.g. after the filter's parameters changed, which may also change its radius."""
+        self.reset()
+        if hasattr(self._filter, 'refresh'):
+            self._filter.refresh()
+        if self._fixedRadius is None:
+            self.radius = filterRadius(self._filter)
+
+    def reset(self):
+        """Filter the whole of the next frame, without touching the wrapped filter (unlike refresh)."""
+        self._framesSinceRefresh = self.refreshInterval
+
+    def _changedTiles(self, src, rowBounds, colBounds):
+        difference = self._difference
+        cv2.absdiff(src, self._reference, difference)
+        cv2.threshold(difference, self.threshold, 1, cv2.THRESH_BINARY, difference)
+        # Count the changed values of each tile from the corners of an integral image, with the channels side by side in each row.
+        channels = src.shape[2] if src.ndim == 3 else 1
+        self._integral = cv2.integral(difference.reshape(src.shape[0], -1), self._integral, cv2.CV_32S)
+        corners = self._integral[rowBounds][:, colBounds * channels]
+        counts = corners[1:, 1:] - corners[:-1, 1:] - corners[1:, :-1] + corners[:-1, :-1]
+        return counts >= self.minChangedValues
+
+    def _filterRegion(self, src, top, bottom, left, right, alignment):
+        height, width = src.shape[:2]
+        haloTop = max(_alignDown(top - self.radius, alignment), 0)
+        haloBottom = min(_alignUp(bottom + self.radius, alignment), height)
+        haloLeft = max(_alignDown(left - self.radius, alignment), 0)
+        haloRight = min(_alignUp(right + self.radius, alignment), width)
+        srcRegion = src[haloTop:haloBottom, haloLeft:haloRight]
+        scratch = self._scratch.get(srcRegion.shape)
+        if scratch is None:
+            scratch = np.empty(srcRegion.shape, src.dtype)
+            self._scratch[srcRegion.shape] = scratch
+        _applyFilter(self._filter, srcRegion, scratch)
+        self._output[top:bottom, left:right] = scratch[top - haloTop:bottom - haloTop, left - haloLeft:right - haloLeft]
+        self._reference[top:bottom, left:right] = src[top:bottom, left:right]
+
+    def apply(self, src, dst):  # Apply the filter to the changed tiles only, src and dst may be the same array
+        self._frames += 1
+        height, width = src.shape[:2]
+        rowBounds = np.append(np.arange(0, height, self.tileSize), height)
+        colBounds = np.append(np.arange(0, width, self.tileSize), width)
+        tileCount = (len(rowBounds) - 1) * (len(colBounds) - 1)
+
+        if self._output is None or self._output.shape != src.shape or self._output.dtype != src.dtype:
+            self._output = np.empty_like(src)
+            self._difference = np.empty_like(src)
+            self._integral = None
+            self._scratch = {}
+            self._reference = None
+
+        alignment = filterAlignment(self._filter)
+        if self._reference is None or self._framesSinceRefresh >= self.refreshInterval - 1 or height % alignment or width % alignment:
+            if self._reference is None:
+                self._reference = np.empty_like(src)
+            np.copyto(self._reference, src)
+            _applyFilter(self._filter, src, self._output)
+            self._framesSinceRefresh = 0
+            self._fullRefreshes += 1
+            self._changedTileRatio = 1.0
+            self._tilesRecomputed += tileCount
+            self._tilesTotal += tileCount
+            dst[...] = self._output
+            return
+        self._framesSinceRefresh += 1
+
+        dirty = self._changedTiles(src, rowBounds, colBounds).astype(np.uint8)
+        # A changed source pixel reaches output pixels up to radius away, or up to the next multiple of the alignment.
+        haloTiles = -(-(self.radius + alignment - 1) // self.tileSize)
+        if haloTiles > 0 and dirty.any():
+            dirty = cv2.dilate(dirty, np.ones((2 * haloTiles + 1, 2 * haloTiles + 1), np.uint8), borderType=cv2.BORDER_CONSTANT,
+                               borderValue=0)
+
+        for row in np.flatnonzero(dirty.any(axis=1)):
+            # Filter each horizontal run of dirty tiles in one call.
+            runs = np.flatnonzero(np.diff(np.concatenate(([0], dirty[row], [0]))))
+            for start, stop in zip(runs[::2], runs[1::2]):
+                self._filterRegion(src, rowBounds[row], rowBounds[row + 1], colBounds[start], colBounds[stop], alignment)
+
+        recomputed = int(np.count_nonzero(dirty))
+        self._changedTileRatio = recomputed / tileCount
+        self._tilesRecomputed += recomputed
+        self._tilesTotal += tileCount
+        dst[...] = self._output
+
+
+# Filters can be chosen by name, e.g. on the command line of cameo.py and batch.py. A filter chain is a comma-separated list of filter specifications, each
+# a registered name optionally followed by keyword arguments for its constructor, e.g. 'strokeEdges:blurKsize=5:edgeKsize=3,exoFilter'. The names are
+# strokeEdges (a StrokeEdgesFilter) and every VConvolutionFilter subclass in this module, under its class name. The registry is only built on first use,
+# and a filter is only constructed when a chain names it.
+
+_filterRegistry = None
+
+
+def _registry():
+    global _filterRegistry
+    if _filterRegistry is None:
+        registry = {'strokeEdges': StrokeEdgesFilter}
+        for name, value in globals().items():
+            if isinstance(value, type) and issubclass(value, VConvolutionFilter) and value is not VConvolutionFilter:
+                registry[name] = value
+        _filterRegistry = registry
+    return _filterRegistry
+
+
+def filterNames():
+    """Return the sorted names that createFilter accepts."""
+    return sorted(_registry())
+
+
+def _parseValue(text):
+    for parse in (int, float):
+        try:
+            return parse(text)
+        except ValueError:
+            pass
+    if text.lower() in ('true', 'false'):
+        return text.lower() == 'true'
+    return text
+
+
+def createFilter(specification):
+    """Return a new filter for a specification like 'strokeEdges:blurKsize=5'. Raise ValueError for an unknown name or bad arguments."""
+    name, *arguments = specification.strip().split(':')
+    cls = _registry().get(name)
+    if cls is None:
+        raise ValueError('unknown filter: %s (choose from %s)' % (name, ', '.join(filterNames())))
+    kwargs = {}
+    for argument in arguments:
+        key, separator, value = argument.partition('=')
+        if not separator:
+            raise ValueError('bad filter argument %r in %r, expected key=value' % (argument, specification))
+        kwargs[key.strip()] = _parseValue(value.strip())
+    try:
+        return cls(**kwargs)
+    except TypeError as error:
+        raise ValueError('bad arguments for %s: %s' % (name, error))
+
+
+def createFilterPipeline(chain):
+    """Return a FilterPipeline for a comma-separated chain of filter specifications."""
+    return FilterPipeline([createFilter(specification) for specification in chain.split(',') if specification.strip()])
+
+
+def warmUp(aFilter, shape, dtype=np.uint8):
+    """Run aFilter once on a blank frame of the given shape and return the seconds it took.
+
+    This does the one-time work (FilterPipeline plans, scratch buffers, OpenCV's own initialization of each kernel) before the first real frame.
+    """
+    frame = np.zeros(shape, dtype)
+    start = time.perf_counter()
+    _applyFilter(aFilter, frame, frame)
+    if hasattr(aFilter, 'reset'):
+        # Do not let an IncrementalFilter take the blank frame as its reference, but keep everything else that was just set up.
+        aFilter.reset()
+    return time.perf_counter() - start
@@ -0,0 +1,91 @@
+import threading
+import numpy as np
+
+"""
+Every frame that CaptureManager hands to the application used to be a new array: exitFrame dropped the frame, so retrieve allocated the next one, the 10 to
+8 bit conversion allocated two more, and the mirrored preview went through another full-frame copy. At 1080p that is several megabytes per frame of
+allocation and page faulting for the memory allocator, and pauses when it returns the memory to the system.
+
+A FramePool keeps released arrays on free lists keyed by (tag, shape, dtype), where the tag tells their use apart (a capture channel, 'preview', ...), and
+acquire hands them out again. The retrieve method decodes a capture's next image straight into a pooled array: VideoCapture.retrieve writes into the array it
+is given when the shape and type match, and the pool remembers the last shape and type of every channel to pick a matching array. When they change (or the
+first time), retrieve falls back to the array that OpenCV allocated and adopts it into the pool when it is released.
+
+Arrays from a pool are only valid until they are released, which CaptureManager does in exitFrame, so an application that keeps a frame for longer must copy
+it. The stats method counts allocations and reuses; in the steady state, allocations stops growing.
+"""
+
+
+class FramePool(object):
+    """Recycles preallocated frame arrays, keyed by (tag, shape, dtype). Thread safe."""
+
+    def __init__(self, maxFreePerKey=4):
+        self.maxFreePerKey = maxFreePerKey
+        self._free = {}  # Non public variable
+        self._formats = {}  # Non public variable
+        self._lock = threading.Lock()  # Non public variable
+        self._allocations = 0  # Non public variable
+        self._reuses = 0  # Non public variable
+        self._releases = 0  # Non public variable
+        self._discarded = 0  # Non public variable
+
+    def stats(self):
+        """Return a snapshot of the pool's counters and of the memory it holds on its free lists."""
+        with self._lock:
+            freeArrays = [array for arrays in self._free.values() for array in arrays]
+            return {
+                'allocations': self._allocations,
+                'reuses': self._reuses,
+                'releases': self._releases,
+                'discarded': self._discarded,
+                'freeBuffers': len(freeArrays),
+                'freeBytes': sum(array.nbytes for array in freeArrays),
+            }
+
+    def acquire(self, tag, shape, dtype):
+        """Return an array of the given shape and dtype, with undefined contents."""
+        key = (tag, tuple(shape), np.dtype(dtype))
+        with self._lock:
+            arrays = self._free.get(key)
+            if arrays:
+                self._reuses += 1
+                return arrays.pop()
+            self._allocations += 1
+        return np.empty(shape, dtype)
+
+    def release(self, tag, array):
+        """Give an array back to the pool. The caller must not use it afterwards. Releasing an array that is already free does nothing."""
+        if array is None:
+            return
+        key = (tag, array.shape, array.dtype)
+        with self._lock:
+            arrays = self._free.setdefault(key, [])
+            if any(free is array for free in arrays):
+                # Released twice: keeping it twice would hand the same memory to two callers.
+                return
+            self._releases += 1
+            if len(arrays) < self.maxFreePerKey:
+                arrays.append(array)
+            else:
+                self._discarded += 1
+
+    def retrieve(self, capture, channel=0):
+        """Retrieve the image of the given channel from capture's grabbed frame into a pooled array. Return None on failure."""
+        if getattr(capture, 'framePool', None) is self:
+            # The capture already retrieves into this pool (e.g. a ThreadedCapture) and hands over its arrays.
+            _, image = capture.retrieve(None, channel)
+            return image
+
+        frameFormat = self._formats.get(channel)
+        buffer = self.acquire(channel, *frameFormat) if frameFormat is not None else None
+        success, image = capture.retrieve(buffer, channel)
+        if not success or image is None:
+            self.release(channel, buffer)
+            return None
+        if image is not buffer:
+            # First frame of this channel, or its format changed: OpenCV allocated the image.
+            self.release(channel, buffer)
+            self._formats[channel] = (image.shape, image.dtype)
+            with self._lock:
+                self._allocations += 1
+        return image
@@ -1,6 +1,15 @@
+import collections
+import concurrent.futures
+import threading
 import cv2
 import numpy as np
 import time
+from telemetry import FrameTelemetry, RollingStats
+from writers import AsyncImageWriter, AsyncVideoWriter, PreRollBuffer, SegmentedVideoWriter
+
+# Policies for the optional prefetching capture thread (see ThreadedCapture).
+PREFETCH_DROP_OLDEST = 'drop_oldest'  # Lowest latency for live cameras
+PREFETCH_BLOCK = 'block'  # Lossless, for processing video files
 
 """
 We create a class called CaptureManager and WindowManager as high-level interfaces to I/O streams. This applicaiton code may use CaptureManager to read
@@ -13,24 +22,43 @@ property is an image corresponding to the current channel's state when enterFram
 
 A CaptureManager also has the writeImage, startWritingVideo, and stopWritingVideo methods that may be called at any time. Actual file writing is postponed 
 until next frame may be shown in a window, depending on whether the application code provides a WindowManager class either as an argument to the constructor 
-of CaptureManager or by setting the previewWindowManager property. 
+of CaptureManager or by setting the previewWindowManager property. Likewise, exited frames are published to an MJPEGStreamer (see streaming.py) given as the
+streamer argument or property.
 
 If the application code manipulates frame, the manipulations are reflected in recorded files and in the window. A CaptureManager class has a constructor argument 
 and property called shouldMirrorPreview, which should be True if we want frame to be mirrored (horizontally flipped) in the window but not in recorded files. Typically, 
 when facing a camera.
 
+Given a FramePool (see framepool.py), a CaptureManager retrieves frames into recycled arrays, converts 10-bit frames into pooled 8-bit arrays and mirrors the
+preview with cv2.flip into a pooled array, so the steady state makes no full-frame allocations. The frames then only stay valid until exitFrame, which gives
+their arrays back to the pool.
+
 Recall that a VideoWriter object needs a frame rate, but OpenCV does not provide any reliable way to get an accurate frame rate for a camera. The CaptureManager class 
-works around this limitation by using a frame counter and Python's standard time.time function to estimate the frame rate if necessary. This approach is not foolproof. 
-Depending on frame rate fluctuations and the system-dependent implementation of time.time, the accuracy of the estimate might still be poor in some cases. However, 
-if we deploy to unknown hardware, it is better than just assuming that the user's camera has a particular frame rate.
+works around this limitation by timing every stage of every frame with the monotonic time.perf_counter function (see FrameTelemetry in telemetry.py), and uses the 
+smoothed frame rate as an estimate if necessary. This approach is not foolproof: if the frame rate fluctuates, the estimate might still be poor in some cases. However, 
+if we deploy to unknown hardware, it is better than just assuming that the user's camera has a particular frame rate. Until the estimate is available, the frames
+to record are held in memory rather than dropped.
+
+Given a PreRollBuffer (see writers.py) as the preRollBuffer argument or property, a CaptureManager keeps the last exited frames while it is not recording.
+startWritingVideo then starts the file with them, at the frame rate given by their timestamps when the capture does not report one, so a recording can
+begin a few seconds before it was requested.
+
+startWritingVideo with segmentSeconds or segmentBytes splits the recording into segment files with a manifest, so a long session neither grows one huge file
+nor loses everything to a crash (see SegmentedVideoWriter in writers.py).
 """
 
 
 class CaptureManager(object):
 
-    def __init__(self, capture, previewWindowManager=None, shouldMirrorPreview=False, shouldConvertBitDepth10To8=True):
+    def __init__(self, capture, previewWindowManager=None, shouldMirrorPreview=False, shouldConvertBitDepth10To8=True,
+                 prefetchPolicy=None, prefetchBufferSize=2, prefetchChannels=(0,), framePool=None, streamer=None, preRollBuffer=None):
+
+        if prefetchPolicy is not None and capture is not None:
+            capture = ThreadedCapture(capture, prefetchPolicy, prefetchBufferSize, prefetchChannels, framePool)
 
         self.previewWindowManager = previewWindowManager
+        self.streamer = streamer
+        self.preRollBuffer = preRollBuffer
         self.shouldMirrorPreview = shouldMirrorPreview
         self.shouldConvertBitDepth10To8 = \
             shouldConvertBitDepth10To8
@@ -41,10 +69,18 @@ class CaptureManager(object):
         self._imageFilename = None  # Non public variable
         self._videoFilename = None  # Non public variable
         self._videoEncoding = None  # Non public variable
+        self._videoSegmentSeconds = None  # Non public variable
+        self._videoSegmentBytes = None  # Non public variable
         self._videoWriter = None  # Non public variable
-        self._startTime = None  # Non public variable
+        self._imageWriter = None  # Non public variable
+        self._heldVideoFrames = None  # Non public variable
         self._framesElapsed = 0  # Non public variable
         self._fpsEstimate = None  # Non public variable
+        self._enteredFrameTime = None  # Non public variable
+        self._retrieveTime = 0.0  # Non public variable
+        self._framePool = framePool  # Non public variable
+        self._frameBuffers = []  # Non public variable
+        self.telemetry = FrameTelemetry()
 
     # Adding getters and setters
 
@@ -64,16 +100,36 @@ class CaptureManager(object):
             self._channel = value
             self._frame = None
 
+    @property
+    def framePool(self):
+        return self._framePool
+
     @property
     def frame(self):
         if self._enteredFrame and self._frame is None:
-            _, self._frame = self._capture.retrieve(
-                self._frame, self.channel)
+            retrieveStart = time.perf_counter()
+            if self._framePool is not None:
+                # Retrieve into a recycled array, which goes back to the pool in exitFrame.
+                self._frame = self._framePool.retrieve(self._capture, self.channel)
+                # A ThreadedCapture hands out the same array each time a channel is read again in the same frame, so release it only once.
+                if self._frame is not None and not any(buffer is self._frame for _, buffer in self._frameBuffers):
+                    self._frameBuffers.append((self.channel, self._frame))
+            else:
+                _, self._frame = self._capture.retrieve(
+                    self._frame, self.channel)
             # The second if statement will help us manipulate and display frames form some channels, notably cv2.CAP_OPENNI_IR_IMAGE.
             if self.shouldConvertBitDepth10To8 and \
                     self._frame is not None and \
                     self._frame.dtype == np.uint16:
-                self._frame = (self._frame >> 2).astype(np.uint8)
+                if self._framePool is not None:
+                    frame8 = self._framePool.acquire(self.channel, self._frame.shape, np.uint8)
+                    self._frameBuffers.append((self.channel, frame8))
+                else:
+                    frame8 = np.empty(self._frame.shape, np.uint8)
+                # Shift straight into the 8-bit array, without a 16-bit temporary.
+                np.right_shift(self._frame, 2, out=frame8, casting='unsafe')
+                self._frame = frame8
+            self._retrieveTime += time.perf_counter() - retrieveStart
         return self._frame
 
     @property
@@ -92,7 +148,11 @@ class CaptureManager(object):
             'previous enterFrame() had no matching exitFrame()'
 
         if self._capture is not None:
+            grabStart = time.perf_counter()
             self._enteredFrame = self._capture.grab()
+            self._enteredFrameTime = time.perf_counter()
+            self.telemetry.record('grab', self._enteredFrameTime - grabStart)
+            self._retrieveTime = 0.0
 
         # The implementation fo exitFrame takes the image from the current channel, estimates a frame rate, shows the image via the window manager
 
@@ -101,39 +161,87 @@ class CaptureManager(object):
     def exitFrame(self):
         """Draw to the window. Write to files. Release the frame."""
 
+        # Everything since enterFrame, apart from retrieving frames, was the application's processing.
+        exitStart = time.perf_counter()
+        processTime = exitStart - self._enteredFrameTime - self._retrieveTime if self._enteredFrame else None
+
         # Check whether any grabbed frame is retrievable.
         # The getter may retrieve and cache the frame.
         if self.frame is None:
             self._enteredFrame = False
+            self._releaseFrameBuffers()
             return
 
-        # Update the FPS estimate and related variables.
-        if self._framesElapsed == 0:
-            self._startTime = time.time()
-        else:
-            timeElapsed = time.time() - self._startTime
-            self._fpsEstimate = self._framesElapsed / timeElapsed
+        telemetry = self.telemetry
+        telemetry.record('retrieve', self._retrieveTime)
+        telemetry.record('process', processTime)
         self._framesElapsed += 1
 
         # Draw to the window, if any.
         if self.previewWindowManager is not None:
-            if self.shouldMirrorPreview:
-                mirroredFrame = np.fliplr(self._frame)
-                self.previewWindowManager.show(mirroredFrame)
-            else:
-                self.previewWindowManager.show(self._frame)
-
-        # Write to the image file, if any.
+            previewStart = time.perf_counter()
+            previewFrame = self._frame
+            previewBuffer = None
+            if self.shouldMirrorPreview or telemetry.shouldDrawOverlay:
+                # Mirror and draw the overlay on a separate (pooled, if possible) array, so that neither is recorded.
+                if self._framePool is not None:
+                    previewBuffer = self._framePool.acquire('preview', self._frame.shape, self._frame.dtype)
+                if self.shouldMirrorPreview:
+                    previewFrame = cv2.flip(self._frame, 1, previewBuffer)
+                elif previewBuffer is not None:
+                    np.copyto(previewBuffer, self._frame)
+                    previewFrame = previewBuffer
+                else:
+                    previewFrame = self._frame.copy()
+                if telemetry.shouldDrawOverlay:
+                    telemetry.drawOverlay(previewFrame)
+            self.previewWindowManager.show(previewFrame)
+            if previewBuffer is not None:
+                self._framePool.release('preview', previewBuffer)
+            telemetry.record('preview', time.perf_counter() - previewStart)
+
+        # Publish the frame to the network stream, if any. Unlike the preview, the stream is never mirrored.
+        if self.streamer is not None:
+            streamStart = time.perf_counter()
+            self.streamer.publish(self._frame)
+            telemetry.record('stream', time.perf_counter() - streamStart)
+
+        # Hand the frame to the image and video writers, if any. They encode and write on worker threads, so the main loop
+        # only pays for one copy of the frame, shared by both writers.
+        writtenFrame = None
         if self.isWritingImage:
-            cv2.imwrite(self._imageFilename, self._frame)
+            imageWriteStart = time.perf_counter()
+            writtenFrame = self._frame.copy()
+            if self._imageWriter is None:
+                self._imageWriter = AsyncImageWriter()
+            self._imageWriter.write(self._imageFilename, writtenFrame)
             self._imageFilename = None
-
-        # Write to the video file, if any.
-        self._writeVideoFrame()
+            telemetry.record('imageWrite', time.perf_counter() - imageWriteStart)
+
+        # Write to the video file, if any. Otherwise keep the frame in the pre-roll buffer, if any, for the next recording.
+        if self.isWritingVideo:
+            videoWriteStart = time.perf_counter()
+            self._writeVideoFrame(writtenFrame)
+            telemetry.record('videoWrite', time.perf_counter() - videoWriteStart)
+        elif self.preRollBuffer is not None:
+            videoWriteStart = time.perf_counter()
+            self.preRollBuffer.append(self._frame, self._enteredFrameTime)
+            telemetry.record('videoWrite', time.perf_counter() - videoWriteStart)
+
+        # Update the FPS estimate.
+        telemetry.frameCompleted()
+        self._fpsEstimate = telemetry.fps
 
         # Release the frame.
         self._frame = None
         self._enteredFrame = False
+        self._releaseFrameBuffers()
+
+    def _releaseFrameBuffers(self):
+        if self._framePool is not None:
+            for tag, buffer in self._frameBuffers:
+                self._framePool.release(tag, buffer)
+        self._frameBuffers = []
 
     # The following methods 'writeImage', 'startWritingImage', and 'stopWritingImage' simply update the parameters for file-writing operations,
     # whereas the actual writing operations are postponed to the next call of exitFrame.
@@ -143,37 +251,81 @@ class CaptureManager(object):
         self._imageFilename = filename
 
     def startWritingVideo(
-            self, filename, encoding=cv2.VideoWriter_fourcc('M', 'J', 'P', 'G')):
-        """Start writing exited frames to a video file."""
+            self, filename, encoding=cv2.VideoWriter_fourcc('M', 'J', 'P', 'G'), segmentSeconds=None, segmentBytes=None):
+        """Start writing exited frames to a video file, after the frames in the pre-roll buffer, if any.
+
+        With segmentSeconds or segmentBytes, the recording is split into segment files of bounded duration or size, with a manifest (see
+        SegmentedVideoWriter).
+        """
+        if self.isWritingVideo:
+            self.stopWritingVideo()
         self._videoFilename = filename
         self._videoEncoding = encoding
+        self._videoSegmentSeconds = segmentSeconds
+        self._videoSegmentBytes = segmentBytes
 
     def stopWritingVideo(self):
-        """Stop writing exited frames to a video file."""
+        """Stop writing exited frames to a video file.
+
+        Queued frames are flushed to the file before this returns. Return the writer's final stats, or None if no frame was written.
+        """
+        stats = None
+        if self._videoWriter is None and self.isWritingVideo:
+            # Stopped while the frame rate was still being estimated, so write the held frames at the best estimate so far.
+            held = self._videoFramesHeld()
+            if held.frameCount:
+                self._openVideoWriter(held.fps or self._fpsEstimate or 30.0)
+        if self._videoWriter is not None:
+            stats = self._videoWriter.close()
         self._videoFilename = None
         self._videoEncoding = None
+        self._videoSegmentSeconds = None
+        self._videoSegmentBytes = None
         self._videoWriter = None
+        return stats
+
+    def release(self):
+        """Flush any pending image and video writes, then release the capture."""
+        self.stopWritingVideo()
+        if self._imageWriter is not None:
+            self._imageWriter.close()
+            self._imageWriter = None
+        if self._capture is not None:
+            self._capture.release()
 
-        if self._videoWriter is None:
-            fps = self._capture.get(cv2.CAP_PROP_FPS)
-            if fps <= 0.0:
-                # The capture's FPS is unknown so use an estimate.
-                if self._framesElapsed < 20:
-                    # Wait until more frames elapse so that the
-                    # estimate is more stable.
-                    return
-                else:
-                    fps = self._fpsEstimate
-            size = (int(self._capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
-                    int(self._capture.get(cv2.CAP_PROP_FRAME_HEIGHT)))
-            self._videoWriter = cv2.VideoWriter(self._videoFilename, self._videoEncoding, fps, size)
-
-        self._videoWriter.write(self._frame)
+    def get(self, propId):
+        """Return a property of the capture, like VideoCapture.get."""
+        return self._capture.get(propId)
 
-    # The following method creates or appends to a video file. However, in situations where the frame rate is unkown, we skip some frames at the start of the capture session
-    # so that we have time to build up the estimate of the frame rate.
+    @property
+    def videoWriterStats(self):
+        """Backpressure counters of the current video writer, if any."""
+        if self._videoWriter is None:
+            return None
+        return self._videoWriter.stats()
+
+    # The following method creates or appends to a video file. However, in situations where the frame rate is unkown, we hold the first frames of the capture session
+    # (in the pre-roll buffer, or a temporary one) so that we have time to build up the estimate of the frame rate, then write them with the rest.
+
+    def _videoFramesHeld(self):
+        if self.preRollBuffer is not None:
+            return self.preRollBuffer
+        if self._heldVideoFrames is None:
+            self._heldVideoFrames = PreRollBuffer(seconds=None, maxBytes=None)
+        return self._heldVideoFrames
+
+    def _openVideoWriter(self, fps):
+        if self._videoSegmentSeconds or self._videoSegmentBytes:
+            self._videoWriter = SegmentedVideoWriter(self._videoFilename, self._videoEncoding, fps, self._videoSegmentSeconds,
+                                                     self._videoSegmentBytes)
+        else:
+            self._videoWriter = AsyncVideoWriter(self._videoFilename, self._videoEncoding, fps)
+        held = self._videoFramesHeld()
+        if held.frameCount:
+            # The buffered frames go to the worker as one item, which is never dropped.
+            self._videoWriter.writeFrames(held.take())
 
-    def _writeVideoFrame(self):
+    def _writeVideoFrame(self, frame=None):
 
         if not self.isWritingVideo:
             return
@@ -181,47 +333,466 @@ class CaptureManager(object):
         if self._videoWriter is None:
             fps = self._capture.get(cv2.CAP_PROP_FPS)
             if fps <= 0.0:
-                # The capture's FPS is unknown so use an estimate.
-                if self._framesElapsed < 20:
-                    # Wait until more frames elapse so that the
+                # The capture's FPS is unknown so use the timestamps of the held frames, or an estimate.
+                held = self._videoFramesHeld()
+                if held.frameCount < 20 and self._framesElapsed < 20:
+                    # Hold the frame until more frames elapse so that the
                     # estimate is more stable.
+                    held.append(self._frame if frame is None else frame, self._enteredFrameTime)
                     return
-                else:
-                    fps = self._fpsEstimate
-            size = (int(self._capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
-                    int(self._capture.get(cv2.CAP_PROP_FRAME_HEIGHT)))
-            self._videoWriter = cv2.VideoWriter(
-                self._videoFilename, self._videoEncoding, fps, size)
+                fps = held.fps or self._fpsEstimate
+            self._openVideoWriter(fps)
+
+        if frame is None:
+            frame = self._frame.copy()
+        self._videoWriter.write(frame)
+
+
+# Opening a camera can take hundreds of milliseconds, so a CaptureManager built around cv2.VideoCapture(0) blocks its creator for that long. LazyCapture stands
+# in for a cv2.VideoCapture and only opens it (and sets the given properties, e.g. the frame size) on first use. Wrapped in a ThreadedCapture, that first use
+# is the producer thread's first grab, so the device opens in the background while the application finishes starting up. openSeconds tells how long the
+# open took, once it has happened.
+
+class LazyCapture(object):
+
+    def __init__(self, source, properties=()):
+        self._source = source  # Non public variable
+        self._properties = tuple(properties)  # Non public variable
+        self._capture = None  # Non public variable
+        self._lock = threading.Lock()  # Non public variable
+        self.openSeconds = None
+
+    @property
+    def source(self):
+        return self._source
+
+    @property
+    def isOpen(self):
+        return self._capture is not None
+
+    def open(self):
+        """Open the capture now if it is not open yet, and return it."""
+        with self._lock:
+            if self._capture is None:
+                openStart = time.perf_counter()
+                capture = cv2.VideoCapture(self._source)
+                for propId, value in self._properties:
+                    capture.set(propId, value)
+                self.openSeconds = time.perf_counter() - openStart
+                self._capture = capture
+            return self._capture
+
+    def grab(self):
+        return self.open().grab()
+
+    def retrieve(self, image=None, channel=0):
+        return self.open().retrieve(image, channel)
+
+    def get(self, propId):
+        return self.open().get(propId)
+
+    def isOpened(self):
+        return self.open().isOpened()
+
+    def release(self):
+        with self._lock:
+            if self._capture is not None:
+                self._capture.release()
+                self._capture = None
+
+
+# By default, grab() and retrieve() run on the application's main loop thread, so the camera or decoder latency adds directly to the time spent
+# filtering. When CaptureManager is given a prefetchPolicy, it wraps its capture in a ThreadedCapture, which grabs and retrieves the requested channels on a
+# producer thread into a bounded ring buffer. ThreadedCapture exposes the same grab, retrieve, get and release methods as cv2.VideoCapture, so enterFrame,
+# exitFrame and the channel property work unchanged, while decoding the next frame overlaps with the processing of the current one. When the buffer is full,
+# PREFETCH_DROP_OLDEST discards the oldest frame (best for live cameras) and PREFETCH_BLOCK makes the producer wait (best for video files, where every frame counts).
+# Given a FramePool, the producer retrieves into pooled arrays. The images of dropped frames, and those of a consumed frame that retrieve never handed out,
+# go back to the pool; the ones it handed out belong to the caller (CaptureManager releases them to the same pool in exitFrame).
+
+class ThreadedCapture(object):
+
+    def __init__(self, capture, policy=PREFETCH_DROP_OLDEST, bufferSize=2, channels=(0,), framePool=None):
+        if policy not in (PREFETCH_DROP_OLDEST, PREFETCH_BLOCK):
+            raise ValueError('unknown prefetch policy: %r' % (policy,))
+        if bufferSize < 1:
+            raise ValueError('bufferSize must be at least 1')
+
+        self._capture = capture  # Non public variable
+        self._policy = policy  # Non public variable
+        self._bufferSize = bufferSize  # Non public variable
+        self._channels = tuple(channels)  # Non public variable
+        self._buffer = collections.deque()  # Non public variable
+        self._condition = threading.Condition()  # Non public variable
+        self._captureLock = threading.Lock()  # Non public variable
+        self._current = None  # Non public variable
+        self._handedOut = set()  # Non public variable
+        self.framePool = framePool
+        self._isRunning = True  # Non public variable
+        self._isFinished = False  # Non public variable
+        self._framesDropped = 0  # Non public variable
+        self._thread = threading.Thread(target=self._run, name='ThreadedCapture', daemon=True)
+        self._thread.start()
+
+    @property
+    def framesDropped(self):
+        return self._framesDropped
+
+    @property
+    def bufferedFrames(self):
+        return len(self._buffer)
+
+    def _run(self):
+        while self._isRunning:
+            with self._captureLock:
+                if not self._capture.grab():
+                    break
+                retrieved = {}
+                for channel in self._channels:
+                    if self.framePool is not None:
+                        retrieved[channel] = self.framePool.retrieve(self._capture, channel)
+                    else:
+                        success, image = self._capture.retrieve(None, channel)
+                        retrieved[channel] = image if success else None
+
+            with self._condition:
+                if self._policy == PREFETCH_BLOCK:
+                    while self._isRunning and len(self._buffer) >= self._bufferSize:
+                        self._condition.wait()
+                elif len(self._buffer) >= self._bufferSize:
+                    self._recycle(self._buffer.popleft())
+                    self._framesDropped += 1
+                if not self._isRunning:
+                    break
+                self._buffer.append(retrieved)
+                self._condition.notify_all()
+
+        with self._condition:
+            self._isFinished = True
+            self._condition.notify_all()
+
+    def _recycle(self, retrieved, handedOut=()):
+        # Give the images of a dropped or consumed frame back to the pool, except those handed out by retrieve, which now belong to the caller.
+        if self.framePool is None or retrieved is None:
+            return
+        for channel, image in retrieved.items():
+            if channel not in handedOut:
+                self.framePool.release(channel, image)
+
+    def grab(self):
+        """Advance to the next prefetched frame, waiting for one if needed."""
+        self._recycle(self._current, self._handedOut)
+        self._current = None
+        self._handedOut = set()
+        with self._condition:
+            while not self._buffer and not self._isFinished:
+                self._condition.wait()
+            if not self._buffer:
+                self._current = None
+                return False
+            self._current = self._buffer.popleft()
+            self._condition.notify_all()
+        return True
+
+    def retrieve(self, image=None, channel=0):
+        """Return the current frame's image for the given channel."""
+        if self._current is None or self._current.get(channel) is None:
+            return False, None
+        self._handedOut.add(channel)
+        return True, self._current[channel]
+
+    def get(self, propId):
+        with self._captureLock:
+            return self._capture.get(propId)
+
+    def isOpened(self):
+        return not self._isFinished or bool(self._buffer)
+
+    def release(self):
+        """Stop the producer thread and release the wrapped capture."""
+        with self._condition:
+            self._isRunning = False
+            self._condition.notify_all()
+        self._thread.join()
+        self._capture.release()
+
+
+# CaptureManager reads from a single VideoCapture. To drive several cameras (or files) together, MultiCaptureManager takes a list of captures and splits
+# each frame into the two halves of the VideoCapture API. In enterFrame, it calls grab() on every source back-to-back, because grab only latches the next
+# frame and is cheap, so the sources are sampled as close together in time as the drivers allow. The slow part, retrieve() (decoding and color conversion),
+# then runs for all sources in parallel on a thread pool; OpenCV releases the GIL while it decodes, so N sources take about the wall time of one.
+#
+# The frames property returns a bundle with one SourceFrame per source: its index, the image (None if that source dropped the frame) and the
+# time.perf_counter timestamp at which its grab returned. The spread of these timestamps is the inter-source skew of the bundle, which the manager keeps in
+# a RollingStats window along with per-source drop counts (a failed grab or retrieve). Recording stays per source: pass a bundle's images to the writers in
+# writers.py.
+
+SourceFrame = collections.namedtuple('SourceFrame', ('source', 'image', 'timestamp'))
+
+
+class MultiCaptureManager(object):
+
+    def __init__(self, captures, previewWindowManager=None, previewSource=0, shouldMirrorPreview=False,
+                 shouldConvertBitDepth10To8=True):
+        if not captures:
+            raise ValueError('at least one capture is required')
+
+        self.previewWindowManager = previewWindowManager
+        self.previewSource = previewSource
+        self.shouldMirrorPreview = shouldMirrorPreview
+        self.shouldConvertBitDepth10To8 = shouldConvertBitDepth10To8
+        self._captures = list(captures)  # Non public variable
+        self._executor = concurrent.futures.ThreadPoolExecutor(len(self._captures), thread_name_prefix='MultiCaptureManager')  # Non public variable
+        self._channel = 0  # Non public variable
+        self._enteredFrame = False  # Non public variable
+        self._grabbed = [False] * len(self._captures)  # Non public variable
+        self._timestamps = [None] * len(self._captures)  # Non public variable
+        self._dropped = [False] * len(self._captures)  # Non public variable
+        self._frames = None  # Non public variable
+        self._framesDropped = [0] * len(self._captures)  # Non public variable
+        self._skew = None  # Non public variable
+        self._skewStats = RollingStats()  # Non public variable
+        self._enteredFrameTime = None  # Non public variable
+        self._retrieveTime = 0.0  # Non public variable
+        self.telemetry = FrameTelemetry()
+
+    @property
+    def sourceCount(self):
+        return len(self._captures)
+
+    @property
+    def channel(self):
+        return self._channel
+
+    @channel.setter
+    def channel(self, value):
+        if self._channel != value:
+            self._channel = value
+            self._frames = None
+
+    @property
+    def frames(self):
+        """The current bundle of SourceFrames for the current channel, one per source, retrieved in parallel."""
+        if self._enteredFrame and self._frames is None:
+            retrieveStart = time.perf_counter()
+            images = list(self._executor.map(self._retrieve, range(len(self._captures))))
+            self._frames = tuple(SourceFrame(source, image, self._timestamps[source]) for source, image in enumerate(images))
+            self._retrieveTime += time.perf_counter() - retrieveStart
+        return self._frames
+
+    @property
+    def skew(self):
+        """Seconds between the first and the last successful grab of the current frame, or None."""
+        return self._skew
+
+    @property
+    def framesDropped(self):
+        """Number of frames each source failed to grab or retrieve, in source order."""
+        return list(self._framesDropped)
+
+    def stats(self):
+        """Return the frame rate, the p50/p95/p99 inter-source skew in milliseconds and the per-source drop counts."""
+        return {
+            'fps': self.telemetry.fps,
+            'frames': self.telemetry.framesCompleted,
+            'skew': self._skewStats.percentiles(),
+            'framesDropped': list(self._framesDropped),
+        }
+
+    def _retrieve(self, source):
+        if not self._grabbed[source]:
+            return None
+        success, image = self._captures[source].retrieve(None, self._channel)
+        if not success or image is None:
+            # Count a drop once per frame, however many channels fail.
+            if not self._dropped[source]:
+                self._dropped[source] = True
+                self._framesDropped[source] += 1
+            return None
+        if self.shouldConvertBitDepth10To8 and image.dtype == np.uint16:
+            image = (image >> 2).astype(np.uint8)
+        return image
+
+    def enterFrame(self):
+        """Grab the next frame of every source, back-to-back."""
+
+        assert not self._enteredFrame, \
+            'previous enterFrame() had no matching exitFrame()'
+
+        grabStart = time.perf_counter()
+        for source, capture in enumerate(self._captures):
+            self._grabbed[source] = capture.grab()
+            self._timestamps[source] = time.perf_counter()
+            self._dropped[source] = not self._grabbed[source]
+            if not self._grabbed[source]:
+                self._framesDropped[source] += 1
+                self._timestamps[source] = None
+        self._enteredFrameTime = time.perf_counter()
+        self.telemetry.record('grab', self._enteredFrameTime - grabStart)
+        self._retrieveTime = 0.0
+
+        self._enteredFrame = any(self._grabbed)
+        timestamps = [timestamp for timestamp in self._timestamps if timestamp is not None]
+        self._skew = max(timestamps) - min(timestamps) if timestamps else None
+        if self._skew is not None:
+            self._skewStats.record(self._skew)
+        return self._enteredFrame
+
+    def exitFrame(self):
+        """Draw the preview source to the window. Release the frames."""
+
+        exitStart = time.perf_counter()
+        processTime = exitStart - self._enteredFrameTime - self._retrieveTime if self._enteredFrame else None
 
-        self._videoWriter.write(self._frame)
+        if self.frames is None:
+            self._enteredFrame = False
+            return
+
+        telemetry = self.telemetry
+        telemetry.record('retrieve', self._retrieveTime)
+        telemetry.record('process', processTime)
+
+        if self.previewWindowManager is not None and self.previewSource is not None:
+            previewFrame = self._frames[self.previewSource].image
+            if previewFrame is not None:
+                previewStart = time.perf_counter()
+                if self.shouldMirrorPreview:
+                    previewFrame = np.fliplr(previewFrame)
+                if telemetry.shouldDrawOverlay:
+                    previewFrame = np.ascontiguousarray(previewFrame) if self.shouldMirrorPreview else previewFrame.copy()
+                    telemetry.drawOverlay(previewFrame)
+                self.previewWindowManager.show(previewFrame)
+                telemetry.record('preview', time.perf_counter() - previewStart)
+
+        telemetry.frameCompleted()
+
+        self._frames = None
+        self._enteredFrame = False
+
+    def release(self):
+        """Stop the retrieve threads and release every capture."""
+        self._executor.shutdown()
+        for capture in self._captures:
+            capture.release()
 
 
 # For the sake of object orientation and adaptability, we abstract this functionality into a WindowManager class with the createWindow,
 # destroyWindow, show and processEvents methods. As a property, WindowManager has a function object called keypressCallback, which (if it is not 'None')
 # is called from processEvents in response to any keypress. The keypressCallback object is a function that takes a single argument, specifically an ASCII keycode.
+#
+# By default, show and processEvents call imshow and waitKey on the caller's thread, so repainting the window and waitKey's minimum sleep are paid on every frame
+# of the main loop. Given a displayFps, WindowManager instead owns a render thread, which creates the window, shows the latest frame and polls the keyboard at
+# that rate. show then only copies a frame into a single slot when the next display is due (latest wins: a frame that was not displayed yet is replaced), and
+# processEvents delivers the keycodes that the render thread queued to keypressCallback on the caller's thread, without waiting. Processing and recording then
+# run at full rate whatever the display rate. HighGUI needs its windows on the main thread on some platforms (notably macOS), so this mode is opt-in.
 
 class WindowManager(object):
-    def __init__(self, windowName, keypressCallback=None):
+    def __init__(self, windowName, keypressCallback=None, displayFps=None):
         self.keypressCallback = keypressCallback
+        self.displayFps = displayFps
         self._windowName = windowName
         self._isWindowCreated = False
+        self._renderThread = None  # Non public variable
+        self._isRendering = False  # Non public variable
+        self._condition = threading.Condition()  # Non public variable
+        self._pendingFrame = None  # Non public variable
+        self._spareFrame = None  # Non public variable
+        self._keycodes = collections.deque()  # Non public variable
+        self._lastAcceptedTime = None  # Non public variable
+        self._framesShown = 0  # Non public variable
+        self._framesSkipped = 0  # Non public variable
+        self._framesReplaced = 0  # Non public variable
 
     @property
     def isWindowCreated(self):
         return self._isWindowCreated
 
+    def stats(self):
+        """Return how many frames the render thread displayed, and how many show skipped (rate limit) or replaced before display (latest wins)."""
+        return {
+            'framesShown': self._framesShown,
+            'framesSkipped': self._framesSkipped,
+            'framesReplaced': self._framesReplaced,
+        }
+
     def createWindow(self):
-        cv2.namedWindow(self._windowName)
+        if self.displayFps is None:
+            cv2.namedWindow(self._windowName)
+        else:
+            self._isRendering = True
+            self._lastAcceptedTime = None
+            self._renderThread = threading.Thread(target=self._render, name='WindowManager', daemon=True)
+            self._renderThread.start()
         self._isWindowCreated = True
 
     def show(self, frame):
-        cv2.imshow(self._windowName, frame)
+        if self._renderThread is None:
+            cv2.imshow(self._windowName, frame)
+            return
 
-    def destroyWindow(self):
+        now = time.perf_counter()
+        if self._lastAcceptedTime is not None and now - self._lastAcceptedTime < 1.0 / self.displayFps:
+            self._framesSkipped += 1
+            return
+        self._lastAcceptedTime = now
+
+        # The caller may reuse or release the frame after show returns, so copy it, into the spare array if there is one.
+        with self._condition:
+            slot = self._spareFrame
+            self._spareFrame = None
+        if slot is None or slot.shape != frame.shape or slot.dtype != frame.dtype:
+            slot = np.empty(frame.shape, frame.dtype)
+        np.copyto(slot, frame)
+        with self._condition:
+            if self._pendingFrame is not None:
+                self._framesReplaced += 1
+                self._spareFrame = self._pendingFrame
+            self._pendingFrame = slot
+            self._condition.notify()
+
+    def _render(self):
+        cv2.namedWindow(self._windowName)
+        while True:
+            with self._condition:
+                if self._pendingFrame is None and self._isRendering:
+                    # Wake up at the display rate even without frames, to keep polling the keyboard.
+                    self._condition.wait(1.0 / self.displayFps)
+                if not self._isRendering:
+                    break
+                frame = self._pendingFrame
+                self._pendingFrame = None
+            if frame is not None:
+                cv2.imshow(self._windowName, frame)
+                self._framesShown += 1
+                # imshow keeps its own copy, so the array can take the next frame.
+                with self._condition:
+                    if self._spareFrame is None:
+                        self._spareFrame = frame
+            keycode = cv2.waitKey(1)
+            if keycode != -1:
+                self._keycodes.append(keycode)
         cv2.destroyWindow(self._windowName)
+
+    def destroyWindow(self):
+        if self._renderThread is not None:
+            with self._condition:
+                self._isRendering = False
+                self._condition.notify()
+            if self._renderThread is not threading.current_thread():
+                self._renderThread.join()
+            self._renderThread = None
+        else:
+            cv2.destroyWindow(self._windowName)
         self._isWindowCreated = False
 
     def processEvents(self):
-        keycode = cv2.waitKey(1)
-        if self.keypressCallback is not None and keycode != -1:
-            self.keypressCallback(keycode)
\ No newline at end of file
+        if self._renderThread is None and self.displayFps is None:
+            keycode = cv2.waitKey(1)
+            if self.keypressCallback is not None and keycode != -1:
+                self.keypressCallback(keycode)
+            return
+
+        # The render thread polled the keyboard, deliver its keycodes on this thread.
+        while self._keycodes:
+            keycode = self._keycodes.popleft()
+            if self.keypressCallback is not None:
+                self.keypressCallback(keycode)
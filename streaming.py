@@ -0,0 +1,246 @@
+import http.server
+import threading
+import time
+import cv2
+import numpy as np
+
+"""
+MJPEGStreamer serves the processed frames over HTTP as an MJPEG stream (a multipart/x-mixed-replace response with one JPEG per part), which browsers, VLC
+and ffplay display directly:
+
+    http://<host>:<port>/          the stream
+    http://<host>:<port>/stream    the stream
+    http://<host>:<port>/snapshot  the next published frame as a single JPEG
+
+CaptureManager publishes every exited frame to its streamer, like it shows it in its previewWindowManager. publish is cheap: when no stream client is
+connected and no snapshot request is waiting, it does nothing, otherwise it copies the frame into a single latest-wins slot (a frame that the encoder has
+not taken yet is replaced). An encoder thread JPEG-encodes each frame it takes exactly once, with its multipart headers, into one immutable bytes object,
+which every client thread then sends as is. Each client sends the newest part when it is ready for more, so a slow client skips the frames it missed
+instead of holding back the encoder or other clients. A client that cannot take anything for timeout seconds is disconnected. A snapshot request waits for
+the first frame encoded after it arrived, so it is never older than the request, and gets a 503 response if no frame is published within timeout seconds.
+
+clientStats reports, for each connected client, the parts sent and skipped, how many parts it is behind (a client stuck in a send falls behind without
+skipping anything yet), and its lag: the time from publish to the end of sending the part, which grows with encoding time and with the client's network.
+"""
+
+BOUNDARY = b'cameoframe'
+
+
+class MJPEGStreamer(object):
+
+    def __init__(self, host='127.0.0.1', port=8080, quality=80, timeout=10.0):
+        self.quality = quality
+        self.timeout = timeout
+        self._condition = threading.Condition()  # Non public variable
+        self._isRunning = True  # Non public variable
+        self._pendingFrame = None  # Non public variable
+        self._pendingTime = None  # Non public variable
+        self._spareFrame = None  # Non public variable
+        self._part = None  # Non public variable
+        self._jpeg = None  # Non public variable
+        self._partTime = None  # Non public variable
+        self._sequence = 0  # Non public variable
+        self._framesEncoded = 0  # Non public variable
+        self._framesReplaced = 0  # Non public variable
+        self._clients = {}  # Non public variable
+        self._nextClientId = 0  # Non public variable
+        self._snapshotsWaiting = 0  # Non public variable
+        self._snapshotsServed = 0  # Non public variable
+
+        self._server = http.server.ThreadingHTTPServer((host, port), _MJPEGRequestHandler)
+        self._server.daemon_threads = True
+        self._server.streamer = self
+        self._serverThread = threading.Thread(target=self._server.serve_forever, name='MJPEGStreamer', daemon=True)
+        self._serverThread.start()
+        self._encoderThread = threading.Thread(target=self._encode, name='MJPEGStreamer encoder', daemon=True)
+        self._encoderThread.start()
+
+    @property
+    def address(self):
+        """The (host, port) the streamer listens on. Useful with port=0, which picks a free port."""
+        return self._server.server_address[:2]
+
+    @property
+    def clientCount(self):
+        with self._condition:
+            return len(self._clients)
+
+    def stats(self):
+        """Return the encoder's counters."""
+        with self._condition:
+            return {
+                'clients': len(self._clients),
+                'framesEncoded': self._framesEncoded,
+                'framesReplaced': self._framesReplaced,
+                'snapshotsServed': self._snapshotsServed,
+                'partBytes': len(self._part) if self._part is not None else None,
+            }
+
+    def clientStats(self):
+        """Return a list with the address, the parts sent, skipped and not sent yet (partsBehind), and the last and maximum lag in milliseconds of each
+        connected client."""
+        with self._condition:
+            stats = []
+            for client in self._clients.values():
+                client = dict(client)
+                client['partsBehind'] = self._sequence - client.pop('sequence')
+                stats.append(client)
+            return stats
+
+    def publish(self, frame):
+        """Queue a frame for streaming. Return False if no client is connected or waiting for a snapshot, in which case the frame is not even copied."""
+        if not self._clients and not self._snapshotsWaiting:
+            return False
+        with self._condition:
+            slot = self._spareFrame
+            self._spareFrame = None
+        if slot is None or slot.shape != frame.shape or slot.dtype != frame.dtype:
+            slot = np.empty(frame.shape, frame.dtype)
+        np.copyto(slot, frame)
+        with self._condition:
+            if self._pendingFrame is not None:
+                self._framesReplaced += 1
+                self._spareFrame = self._pendingFrame
+            self._pendingFrame = slot
+            self._pendingTime = time.perf_counter()
+            self._condition.notify_all()
+        return True
+
+    def _encode(self):
+        while True:
+            with self._condition:
+                while self._isRunning and self._pendingFrame is None:
+                    self._condition.wait()
+                if not self._isRunning:
+                    break
+                frame, publishTime = self._pendingFrame, self._pendingTime
+                self._pendingFrame = None
+
+            success, jpeg = cv2.imencode('.jpg', frame, (cv2.IMWRITE_JPEG_QUALITY, self.quality))
+            with self._condition:
+                if self._spareFrame is None:
+                    self._spareFrame = frame
+            if not success:
+                continue
+            jpeg = jpeg.tobytes()
+            part = b''.join((b'--', BOUNDARY, b'\r\nContent-Type: image/jpeg\r\nContent-Length: ', str(len(jpeg)).encode(),
+                             b'\r\n\r\n', jpeg, b'\r\n'))
+            with self._condition:
+                self._jpeg = jpeg
+                self._part = part
+                self._partTime = publishTime
+                self._sequence += 1
+                self._framesEncoded += 1
+                self._condition.notify_all()
+
+    def _addClient(self, address):
+        """Register a client. Return its id and the sequence number of the current part, which it will not be sent."""
+        with self._condition:
+            clientId = self._nextClientId
+            self._nextClientId += 1
+            self._clients[clientId] = {'address': '%s:%d' % address[:2], 'partsSent': 0, 'partsSkipped': 0,
+                                       'lagMs': None, 'maxLagMs': None, 'sequence': self._sequence}
+            return clientId, self._sequence
+
+    def _removeClient(self, clientId):
+        with self._condition:
+            self._clients.pop(clientId, None)
+
+    def _nextPart(self, lastSequence):
+        """Wait for a part newer than lastSequence. Return (sequence, part, publishTime), or None once the streamer is closed."""
+        with self._condition:
+            while self._isRunning and self._sequence == lastSequence:
+                self._condition.wait(self.timeout)
+            if not self._isRunning:
+                return None
+            return self._sequence, self._part, self._partTime
+
+    def _snapshot(self):
+        """Wait for a frame encoded after this call. Return its JPEG data, or None if none comes within timeout or the streamer is closed."""
+        with self._condition:
+            self._snapshotsWaiting += 1
+            try:
+                sequence = self._sequence
+                deadline = time.perf_counter() + self.timeout
+                while self._isRunning and self._sequence == sequence:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0.0:
+                        return None
+                    self._condition.wait(remaining)
+                if not self._isRunning:
+                    return None
+                self._snapshotsServed += 1
+                return self._jpeg
+            finally:
+                self._snapshotsWaiting -= 1
+
+    def _partSent(self, clientId, sequence, publishTime):
+        lagMs = (time.perf_counter() - publishTime) * 1000.0
+        with self._condition:
+            client = self._clients.get(clientId)
+            if client is not None:
+                client['partsSent'] += 1
+                # Parts published while this client was busy were never sent to it.
+                client['partsSkipped'] += sequence - client['sequence'] - 1
+                client['sequence'] = sequence
+                client['lagMs'] = lagMs
+                client['maxLagMs'] = lagMs if client['maxLagMs'] is None else max(client['maxLagMs'], lagMs)
+
+    def close(self):
+        """Disconnect the clients, stop the server and the encoder."""
+        with self._condition:
+            self._isRunning = False
+            self._condition.notify_all()
+        self._server.shutdown()
+        self._server.server_close()
+        self._encoderThread.join()
+
+
+class _MJPEGRequestHandler(http.server.BaseHTTPRequestHandler):
+
+    def setup(self):
+        self.timeout = self.server.streamer.timeout
+        http.server.BaseHTTPRequestHandler.setup(self)
+
+    def do_GET(self):
+        streamer = self.server.streamer
+        if self.path in ('/', '/stream'):
+            self._stream(streamer)
+        elif self.path == '/snapshot':
+            jpeg = streamer._snapshot()
+            if jpeg is None:
+                self.send_error(503, 'no frame published')
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/jpeg')
+            self.send_header('Cache-Control', 'no-cache, private')
+            self.send_header('Content-Length', str(len(jpeg)))
+            self.end_headers()
+            self.wfile.write(jpeg)
+        else:
+            self.send_error(404)
+
+    def _stream(self, streamer):
+        self.send_response(200)
+        self.send_header('Cache-Control', 'no-cache, private')
+        self.send_header('Pragma', 'no-cache')
+        self.send_header('Content-Type', 'multipart/x-mixed-replace; boundary=%s' % BOUNDARY.decode())
+        self.end_headers()
+        clientId, lastSequence = streamer._addClient(self.client_address)
+        try:
+            while True:
+                nextPart = streamer._nextPart(lastSequence)
+                if nextPart is None:
+                    break
+                sequence, part, publishTime = nextPart
+                self.wfile.write(part)
+                self.wfile.flush()
+                streamer._partSent(clientId, sequence, publishTime)
+                lastSequence = sequence
+        except OSError:
+            pass  # The client disconnected or timed out.
+        finally:
+            streamer._removeClient(clientId)
+
+    def log_message(self, format, *args):
+        pass  # Keep the console for Cameo's own messages.
@@ -0,0 +1,139 @@
+import time
+import cv2
+import numpy as np
+
+"""
+CaptureManager used to report a single number, a cumulative average frame rate measured with time.time from the first frame, which hides stalls and
+never recovers from a slow start. FrameTelemetry replaces it with per-stage latencies and a smoothed instantaneous frame rate.
+
+CaptureManager times each stage of a frame with time.perf_counter (monotonic, high resolution) and records the durations here:
+    - grab: capture.grab() in enterFrame (with a prefetching capture, the wait for the next prefetched frame)
+    - retrieve: capture.retrieve() and the bit depth conversion in the frame getter
+    - process: whatever the application did between enterFrame and exitFrame, apart from retrieving frames
+    - preview: showing the frame through the window manager
+    - stream: publishing the frame to the MJPEG streamer
+    - imageWrite and videoWrite: handing the frame to the asynchronous writers
+    - frame: the interval between the ends of consecutive frames
+Each stage keeps its last windowSize samples in a preallocated ring, so recording a sample costs one array store and percentiles reflect the recent past
+only. They are computed on demand, which keeps the per-frame overhead to a few microseconds so the telemetry can stay on in production. The frame rate
+is smoothed with an exponential moving average of the frame interval, so it follows load changes within a few frames.
+
+Optionally the telemetry draws a one-line overlay on the previewed frame (never on recorded files), and calls dumpCallback with a summary every
+dumpInterval seconds.
+"""
+
+STAGES = ('grab', 'retrieve', 'process', 'preview', 'stream', 'imageWrite', 'videoWrite', 'frame')
+
+
+class RollingStats(object):
+    """Keeps the last windowSize samples of a duration, in seconds."""
+
+    def __init__(self, windowSize=240):
+        self._samples = np.zeros(windowSize)  # Non public variable
+        self._count = 0  # Non public variable
+
+    @property
+    def count(self):
+        return self._count
+
+    def record(self, value):
+        self._samples[self._count % self._samples.size] = value
+        self._count += 1
+
+    def latest(self):
+        """Return the last sample, or None if there are no samples yet."""
+        if self._count == 0:
+            return None
+        return float(self._samples[(self._count - 1) % self._samples.size])
+
+    def values(self):
+        return self._samples[:min(self._count, self._samples.size)]
+
+    def percentiles(self, percents=(50, 95, 99)):
+        """Return the given percentiles of the window in milliseconds, or None if there are no samples yet."""
+        values = self.values()
+        if values.size == 0:
+            return None
+        return dict(('p%d' % percent, float(value) * 1000.0) for percent, value in zip(percents, np.percentile(values, percents)))
+
+
+class FrameTelemetry(object):
+
+    def __init__(self, windowSize=240, smoothing=0.1, dumpInterval=None, dumpCallback=None, shouldDrawOverlay=False):
+        self.smoothing = smoothing
+        self.dumpInterval = dumpInterval
+        self.dumpCallback = dumpCallback if dumpCallback is not None else print
+        self.shouldDrawOverlay = shouldDrawOverlay
+        self._stages = dict((stage, RollingStats(windowSize)) for stage in STAGES)  # Non public variable
+        self._smoothedInterval = None  # Non public variable
+        self._lastFrameTime = None  # Non public variable
+        self._lastDumpTime = None  # Non public variable
+        self._framesCompleted = 0  # Non public variable
+
+    @property
+    def fps(self):
+        """Smoothed instantaneous frame rate, or None before the second frame."""
+        if not self._smoothedInterval:
+            return None
+        return 1.0 / self._smoothedInterval
+
+    @property
+    def framesCompleted(self):
+        return self._framesCompleted
+
+    def record(self, stage, seconds):
+        self._stages[stage].record(seconds)
+
+    def frameCompleted(self, now=None):
+        """Mark the end of a frame. Update the frame rate and dump the stats if dumpInterval has elapsed."""
+        if now is None:
+            now = time.perf_counter()
+        if self._lastFrameTime is not None:
+            interval = now - self._lastFrameTime
+            self._stages['frame'].record(interval)
+            if self._smoothedInterval is None:
+                self._smoothedInterval = interval
+            else:
+                self._smoothedInterval += self.smoothing * (interval - self._smoothedInterval)
+        self._lastFrameTime = now
+        self._framesCompleted += 1
+
+        if self.dumpInterval is not None:
+            if self._lastDumpTime is None:
+                self._lastDumpTime = now
+            elif now - self._lastDumpTime >= self.dumpInterval:
+                self._lastDumpTime = now
+                self.dumpCallback(self.summary())
+
+    def latest(self, stage):
+        return self._stages[stage].latest()
+
+    def percentiles(self, stage):
+        return self._stages[stage].percentiles()
+
+    def snapshot(self):
+        """Return the frame rate and the p50/p95/p99 latency of each stage in milliseconds, as a dict."""
+        snapshot = {'fps': self.fps, 'frames': self._framesCompleted}
+        for stage in STAGES:
+            snapshot[stage] = self._stages[stage].percentiles()
+        return snapshot
+
+    def summary(self):
+        """Return a one-line summary: the frame rate and the p50/p95 latency of each stage that has samples."""
+        parts = ['%.1f fps' % self.fps if self.fps else '-- fps']
+        for stage in STAGES:
+            percentiles = self._stages[stage].percentiles()
+            if percentiles is not None:
+                parts.append('%s %.1f/%.1f ms' % (stage, percentiles['p50'], percentiles['p95']))
+        return ', '.join(parts)
+
+    def drawOverlay(self, image):
+        """Draw the frame rate and the median latency of the main stages on image, in place."""
+        parts = ['%.1f fps' % self.fps if self.fps else '-- fps']
+        for stage in ('grab', 'retrieve', 'process', 'preview'):
+            values = self._stages[stage].values()
+            if values.size:
+                parts.append('%s %.1f' % (stage, np.median(values) * 1000.0))
+        text = ' | '.join(parts)
+        cv2.putText(image, text, (10, 24), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 0), 3, cv2.LINE_AA)
+        cv2.putText(image, text, (10, 24), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 1, cv2.LINE_AA)
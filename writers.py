@@ -0,0 +1,470 @@
+import bisect
+import collections
+import concurrent.futures
+import json
+import os
+import queue
+import threading
+import cv2
+import numpy as np
+import time
+
+"""
+Writing an image with cv2.imwrite, or a video frame with VideoWriter.write, means encoding the frame (PNG, MJPG, ...) and touching the disk. Both can take longer
+than a frame interval, so if they run inline in CaptureManager.exitFrame, a slow encoder or disk stalls the preview loop and shows up as dropped frames.
+
+The classes in this module move that work to worker threads. The application hands over frames that it no longer modifies (CaptureManager passes one copy
+of the exited frame) and they travel through a bounded queue to the worker, which encodes and writes them. OpenCV releases the GIL while encoding, so the
+main loop keeps running in the meantime. When the queue is full, the writer either drops the new frame or blocks the caller, depending on blockWhenFull.
+The stats method reports the backpressure: the current and peak queue depth, and how many frames were written, dropped, or written late (i.e. more than
+maxLatency seconds after they were queued). Calling close flushes the queue and waits for the worker to finish.
+
+If writing fails (cv2.imwrite returns False, or the VideoWriter cannot be opened, e.g. because the output directory does not exist), the worker keeps
+the first exception, which stats reports as error, and counts the failed frame and every later one as dropped instead of written, so neither the caller
+nor close waits on a queue that nobody empties.
+
+A PreRollBuffer keeps the most recent frames in memory, so that a recording can start a few seconds before it was requested (see CaptureManager).
+A SegmentedVideoWriter splits a recording into files of bounded duration or size, indexed by a JSON manifest.
+"""
+
+
+class AsyncWriter(object):
+    """Base class running a write function on a worker thread fed by a bounded queue."""
+
+    def __init__(self, maxQueueSize=32, blockWhenFull=False, maxLatency=1.0, name='AsyncWriter'):
+        self._queue = queue.Queue(maxQueueSize)  # Non public variable
+        self._blockWhenFull = blockWhenFull  # Non public variable
+        self._maxLatency = maxLatency  # Non public variable
+        self._framesWritten = 0  # Non public variable
+        self._framesDropped = 0  # Non public variable
+        self._framesLate = 0  # Non public variable
+        self._maxQueueDepth = 0  # Non public variable
+        self._isClosed = False  # Non public variable
+        self._error = None  # Non public variable
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    @property
+    def queueDepth(self):
+        return self._queue.qsize()
+
+    @property
+    def isClosed(self):
+        return self._isClosed
+
+    @property
+    def error(self):  # The first exception raised while writing, or None
+        return self._error
+
+    def stats(self):
+        """Return a snapshot of the writer's backpressure counters."""
+        return {
+            'queueDepth': self._queue.qsize(),
+            'maxQueueDepth': self._maxQueueDepth,
+            'framesWritten': self._framesWritten,
+            'framesDropped': self._framesDropped,
+            'framesLate': self._framesLate,
+            'error': None if self._error is None else '%s: %s' % (type(self._error).__name__, self._error),
+        }
+
+    def _put(self, item, block=None):
+        """Queue an item for the worker. Return False if it was dropped."""
+        if self._isClosed:
+            raise ValueError('write to a closed writer')
+        if self._error is not None:
+            self._framesDropped += 1
+            return False
+        try:
+            self._queue.put((time.perf_counter(), item), block=self._blockWhenFull if block is None else block)
+        except queue.Full:
+            self._framesDropped += 1
+            return False
+        self._maxQueueDepth = max(self._maxQueueDepth, self._queue.qsize())
+        return True
+
+    def _run(self):
+        while True:
+            queuedTime, item = self._queue.get()
+            if item is None:
+                break
+            if self._error is not None:
+                # Drain the queue after a failure, so that nobody blocks on it.
+                self._framesDropped += 1
+                continue
+            try:
+                written = self._write(item)
+            except Exception as error:
+                self._error = error
+                self._framesDropped += 1
+                continue
+            self._framesWritten += 1 if written is None else written
+            if time.perf_counter() - queuedTime > self._maxLatency:
+                self._framesLate += 1
+        try:
+            self._finish()
+        except Exception as error:
+            if self._error is None:
+                self._error = error
+
+    def _write(self, item):  # Write an item, return the number of frames written if not 1
+        raise NotImplementedError
+
+    def _finish(self):
+        pass
+
+    def close(self):
+        """Flush the queued frames, stop the worker and return the final stats."""
+        if not self._isClosed:
+            self._isClosed = True
+            if self._thread.is_alive():
+                # The sentinel always waits for room, even when frames are dropped otherwise.
+                self._queue.put((time.perf_counter(), None))
+            self._thread.join()
+        return self.stats()
+
+
+class AsyncImageWriter(AsyncWriter):
+    """Writes (filename, frame) pairs with cv2.imwrite on a worker thread."""
+
+    def __init__(self, maxQueueSize=8, blockWhenFull=False, maxLatency=1.0):
+        AsyncWriter.__init__(self, maxQueueSize, blockWhenFull, maxLatency, 'AsyncImageWriter')
+
+    def write(self, filename, frame):
+        return self._put((filename, frame))
+
+    def _write(self, item):
+        filename, frame = item
+        if not cv2.imwrite(filename, frame):
+            raise IOError('cannot write %s' % filename)
+
+
+class AsyncVideoWriter(AsyncWriter):
+    """Appends frames to a video file with cv2.VideoWriter on a worker thread.
+
+    The VideoWriter is opened on the worker when the first frame arrives, so the frame size is taken from the frames themselves
+    and creating the file does not block the caller either.
+    """
+
+    def __init__(self, filename, encoding, fps, maxQueueSize=32, blockWhenFull=False, maxLatency=1.0):
+        self._filename = filename  # Non public variable
+        self._encoding = encoding  # Non public variable
+        self._fps = fps  # Non public variable
+        self._videoWriter = None  # Non public variable
+        AsyncWriter.__init__(self, maxQueueSize, blockWhenFull, maxLatency, 'AsyncVideoWriter')
+
+    @property
+    def filename(self):
+        return self._filename
+
+    def write(self, frame):
+        return self._put(frame)
+
+    def writeFrames(self, frames):
+        """Queue an iterable of frames, e.g. from PreRollBuffer.take, as a single item. It waits for room in the queue rather than being dropped."""
+        return self._put(_FrameBatch(frames), block=True)
+
+    def _write(self, frame):
+        if isinstance(frame, _FrameBatch):
+            count = 0
+            for batchFrame in frame.frames:
+                self._write(batchFrame)
+                count += 1
+            return count
+        if self._videoWriter is None:
+            size = (frame.shape[1], frame.shape[0])
+            videoWriter = cv2.VideoWriter(self._filename, self._encoding, self._fps, size, frame.ndim == 3)
+            if not videoWriter.isOpened():
+                videoWriter.release()
+                raise IOError('cannot open %s for writing' % self._filename)
+            self._videoWriter = videoWriter
+        self._videoWriter.write(frame)
+
+    def _finish(self):
+        if self._videoWriter is not None:
+            self._videoWriter.release()
+            self._videoWriter = None
+
+
+class _FrameBatch(object):  # Frames queued together by AsyncVideoWriter.writeFrames
+    def __init__(self, frames):
+        self.frames = frames
+
+
+# A PreRollBuffer keeps the last seconds of frames, within a budget of maxBytes. Frames are stored either as copies (the arrays of evicted frames are reused,
+# so a full buffer makes no allocations) or, with a jpegQuality, as JPEG data, which takes about a tenth of the memory but costs an encode per frame on the
+# caller's thread. The oldest frames are evicted when the newest is more than seconds younger, or to make room within maxBytes; either limit may be None.
+# memoryBytes and stats expose how much memory the buffer holds.
+#
+# take hands the buffered frames over (they leave the buffer), oldest first, as an iterable that decodes JPEG data lazily, so AsyncVideoWriter.writeFrames
+# can decode them on its worker thread. fps is derived from the frames' timestamps, which gives the buffered frames their real duration when played back.
+
+class PreRollBuffer(object):
+
+    def __init__(self, seconds=5.0, maxBytes=256 * 2 ** 20, jpegQuality=None):
+        self.seconds = seconds
+        self.maxBytes = maxBytes
+        self.jpegQuality = jpegQuality
+        self._entries = collections.deque()  # Non public variable
+        self._memoryBytes = 0  # Non public variable
+        self._framesEvicted = 0  # Non public variable
+
+    @property
+    def frameCount(self):
+        return len(self._entries)
+
+    @property
+    def memoryBytes(self):
+        return self._memoryBytes
+
+    @property
+    def duration(self):
+        """Seconds between the oldest and the newest buffered frame."""
+        if len(self._entries) < 2:
+            return 0.0
+        return self._entries[-1][0] - self._entries[0][0]
+
+    @property
+    def fps(self):
+        """Frame rate of the buffered frames according to their timestamps, or None with fewer than two frames."""
+        duration = self.duration
+        if duration <= 0.0:
+            return None
+        return (len(self._entries) - 1) / duration
+
+    def stats(self):
+        return {
+            'frames': len(self._entries),
+            'seconds': self.duration,
+            'memoryBytes': self._memoryBytes,
+            'maxBytes': self.maxBytes,
+            'framesEvicted': self._framesEvicted,
+        }
+
+    def append(self, frame, timestamp=None):
+        """Store a copy of frame, taken at timestamp (time.perf_counter by default). Return False if it does not fit in maxBytes at all."""
+        if timestamp is None:
+            timestamp = time.perf_counter()
+        if self.jpegQuality is not None:
+            success, stored = cv2.imencode('.jpg', frame, (cv2.IMWRITE_JPEG_QUALITY, self.jpegQuality))
+            if not success:
+                return False
+            size = stored.nbytes
+        else:
+            stored = None
+            size = frame.nbytes
+        if self.maxBytes is not None and size > self.maxBytes:
+            return False
+
+        spare = None
+        while self._entries and (
+                (self.maxBytes is not None and self._memoryBytes + size > self.maxBytes) or
+                (self.seconds is not None and timestamp - self._entries[0][0] > self.seconds)):
+            _, evicted = self._entries.popleft()
+            self._memoryBytes -= evicted.nbytes
+            self._framesEvicted += 1
+            if stored is None and evicted.shape == frame.shape and evicted.dtype == frame.dtype:
+                spare = evicted
+
+        if stored is None:
+            stored = spare if spare is not None else np.empty(frame.shape, frame.dtype)
+            np.copyto(stored, frame)
+        self._entries.append((timestamp, stored))
+        self._memoryBytes += size
+        return True
+
+    def take(self):
+        """Remove the buffered frames and return them, oldest first, as an iterable of frames."""
+        entries = [stored for _, stored in self._entries]
+        self.clear()
+        if self.jpegQuality is not None:
+            return _DecodedFrames(entries)
+        return entries
+
+    def clear(self):
+        self._entries.clear()
+        self._memoryBytes = 0
+
+
+class _DecodedFrames(object):  # Decodes JPEG data while it is iterated, on whichever thread iterates
+    def __init__(self, encodedFrames):
+        self._encodedFrames = encodedFrames
+
+    def __len__(self):
+        return len(self._encodedFrames)
+
+    def __iter__(self):
+        for encoded in self._encodedFrames:
+            yield cv2.imdecode(encoded, cv2.IMREAD_UNCHANGED)
+
+
+# One VideoWriter per recording grows a single file for as long as the recording lasts, and if the process dies, the file is never finalized (an AVI gets
+# its index on release), so the whole recording may be lost. SegmentedVideoWriter splits a recording into segment files, <stem>_00000<ext>,
+# <stem>_00001<ext>, ..., each holding at most segmentSeconds of frames and/or about segmentBytes of data (estimated from the file size), so a crash
+# costs at most the current segment. VideoWriter writes its file in 256 KiB blocks, so the size of a segment is only seen to grow in such steps, and
+# segmentBytes must be at least MIN_SEGMENT_BYTES.
+#
+# Creating a VideoWriter opens a file and writes its header, and releasing one writes the index, and both can take a while on a slow disk. So neither happens
+# on the thread that writes frames: a finalizer thread opens the next segment as soon as the current one starts, and releases each full segment after the
+# rotation. The finalizer then indexes the closed segment in a JSON manifest, <stem>.json, rewritten atomically after each segment, which lists every closed
+# segment with its first frame, frame count, start time and size. locateFrame uses it to find the segment and frame offset for a point in time, without
+# opening any video file.
+#
+# A segment that cannot be created (e.g. in a missing directory) fails the writer with an IOError, which stats reports as its error.
+
+MIN_SEGMENT_BYTES = 2 ** 20
+
+
+class SegmentedVideoWriter(AsyncVideoWriter):
+
+    def __init__(self, filename, encoding, fps, segmentSeconds=60.0, segmentBytes=None, maxQueueSize=32, blockWhenFull=False, maxLatency=1.0):
+        if not segmentSeconds and not segmentBytes:
+            raise ValueError('segmentSeconds or segmentBytes is required')
+        if segmentBytes is not None and segmentBytes < MIN_SEGMENT_BYTES:
+            raise ValueError('segmentBytes must be at least %d' % MIN_SEGMENT_BYTES)
+        self._stem, self._extension = os.path.splitext(filename)  # Non public variable
+        self.manifestFilename = self._stem + '.json'
+        self._segmentFrames = max(1, int(round(segmentSeconds * fps))) if segmentSeconds else None  # Non public variable
+        self._segmentBytes = segmentBytes  # Non public variable
+        self._lastSize = 0  # Non public variable
+        self._bytesPerFrame = 0.0  # Non public variable
+        self._frameSize = None  # Non public variable
+        self._isColor = True  # Non public variable
+        self._current = None  # Non public variable
+        self._nextSegment = None  # Non public variable
+        self._framesTotal = 0  # Non public variable
+        self._segments = []  # Non public variable
+        self._segmentsLock = threading.Lock()  # Non public variable
+        self._finalizer = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix='SegmentedVideoWriter')  # Non public variable
+        AsyncVideoWriter.__init__(self, filename, encoding, fps, maxQueueSize, blockWhenFull, maxLatency)
+
+    def stats(self):
+        stats = AsyncVideoWriter.stats(self)
+        with self._segmentsLock:
+            stats['segmentsClosed'] = len(self._segments)
+        return stats
+
+    def _segmentFilename(self, index):
+        return '%s_%05d%s' % (self._stem, index, self._extension)
+
+    def _openSegment(self, index):
+        filename = self._segmentFilename(index)
+        videoWriter = cv2.VideoWriter(filename, self._encoding, self._fps, self._frameSize, self._isColor)
+        if not videoWriter.isOpened():
+            videoWriter.release()
+            raise IOError('cannot open %s for writing' % filename)
+        return {'index': index, 'filename': filename, 'videoWriter': videoWriter, 'firstFrame': None, 'frameCount': 0,
+                'wallClockStart': None}
+
+    def _closeSegment(self, segment):
+        segment['videoWriter'].release()
+        entry = {
+            'index': segment['index'],
+            'filename': os.path.basename(segment['filename']),
+            'firstFrame': segment['firstFrame'],
+            'frameCount': segment['frameCount'],
+            'startSeconds': segment['firstFrame'] / self._fps,
+            'durationSeconds': segment['frameCount'] / self._fps,
+            'bytes': os.path.getsize(segment['filename']),
+            'wallClockStart': segment['wallClockStart'],
+        }
+        with self._segmentsLock:
+            self._segments.append(entry)
+        self._writeManifest(complete=False)
+
+    def _discardSegment(self, segment):
+        # A pre-opened segment that never got a frame.
+        segment['videoWriter'].release()
+        if os.path.exists(segment['filename']):
+            os.remove(segment['filename'])
+
+    def _discardOpenedSegment(self, openFuture):
+        # Runs after the opening job, on the same thread, so openFuture is done.
+        if openFuture.exception() is None:
+            self._discardSegment(openFuture.result())
+
+    def _submit(self, job, argument):
+        future = self._finalizer.submit(job, argument)
+        future.add_done_callback(self._finalized)
+        return future
+
+    def _finalized(self, future):
+        # A segment that fails to open, close or be indexed fails the writer.
+        if future.exception() is not None and self._error is None:
+            self._error = future.exception()
+
+    def _writeManifest(self, complete):
+        with self._segmentsLock:
+            segments = list(self._segments)
+        manifest = {
+            'fps': self._fps,
+            'frameSize': self._frameSize,
+            'frameCount': sum(segment['frameCount'] for segment in segments),
+            'complete': complete,
+            'segments': segments,
+        }
+        temporaryFilename = self.manifestFilename + '.tmp'
+        with open(temporaryFilename, 'w') as manifestFile:
+            json.dump(manifest, manifestFile, indent=1)
+        os.replace(temporaryFilename, self.manifestFilename)
+
+    def _isSegmentFull(self):
+        frameCount = self._current['frameCount']
+        if self._segmentFrames is not None and frameCount >= self._segmentFrames:
+            return True
+        if self._segmentBytes is None:
+            return False
+        # VideoWriter buffers its output, so the file grows in steps. Extrapolate from the bytes per frame seen at the last step.
+        size = os.path.getsize(self._current['filename'])
+        if size > self._lastSize:
+            self._bytesPerFrame = size / frameCount
+        self._lastSize = size
+        return max(size, frameCount * self._bytesPerFrame) >= self._segmentBytes
+
+    def _write(self, frame):
+        if isinstance(frame, _FrameBatch):
+            return AsyncVideoWriter._write(self, frame)
+
+        if self._current is None:
+            self._frameSize = (frame.shape[1], frame.shape[0])
+            self._isColor = frame.ndim == 3
+            self._current = self._openSegment(0)
+            self._nextSegment = self._submit(self._openSegment, 1)
+        segment = self._current
+        if segment['firstFrame'] is None:
+            segment['firstFrame'] = self._framesTotal
+            segment['wallClockStart'] = time.time()
+        segment['videoWriter'].write(frame)
+        segment['frameCount'] += 1
+        self._framesTotal += 1
+
+        if self._isSegmentFull():
+            # The next segment was opened while this one was being written, so the rotation itself does not wait on the disk.
+            nextSegment = self._nextSegment.result()
+            self._submit(self._closeSegment, segment)
+            self._current = nextSegment
+            self._lastSize = 0
+            self._nextSegment = self._submit(self._openSegment, nextSegment['index'] + 1)
+
+    def _finish(self):
+        if self._current is not None:
+            self._submit(self._closeSegment if self._current['frameCount'] else self._discardSegment, self._current)
+            self._current = None
+        if self._nextSegment is not None:
+            self._submit(self._discardOpenedSegment, self._nextSegment)
+            self._nextSegment = None
+        self._finalizer.shutdown(wait=True)
+        self._writeManifest(complete=True)
+
+
+def locateFrame(manifestFilename, seconds):
+    """Return the filename of the segment that holds the frame shown at seconds into a segmented recording, and the frame's index in that segment."""
+    with open(manifestFilename) as manifestFile:
+        manifest = json.load(manifestFile)
+    segments = manifest['segments']
+    if not segments:
+        raise ValueError('%s lists no segments' % manifestFilename)
+    frame = max(0, int(seconds * manifest['fps']))
+    index = max(0, bisect.bisect_right([segment['firstFrame'] for segment in segments], frame) - 1)
+    segment = segments[index]
+    offset = min(frame - segment['firstFrame'], segment['frameCount'] - 1)
+    return os.path.join(os.path.dirname(manifestFilename), segment['filename']), offset